@@ -1,31 +1,77 @@
 # 导入必要的模块
-from fastapi import FastAPI, HTTPException, File, UploadFile, Request, Depends, Security
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, File, Form, UploadFile, Request, Depends, Security
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from fastapi.security import APIKeyHeader, HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional, Dict, Any
-import io
-from PIL import Image
+from typing import Optional, Dict, Any, List, Literal, Tuple
+import json
 import os
 import base64
 import uuid
 from datetime import datetime
-import threading
-import time
+import asyncio
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 
 from core.core import config, internal_config, log  # 导入internal_config
-from drawer.sketchbook_drawer import SketchbookGenerator
+from core.render_pool import RenderPool, RenderPoolFull
+from core.image_store import create_image_store
+from core.prefork import process_stats
+from drawer.sketchbook_drawer import RenderOutput, SketchbookGenerator
+from drawer.single_flight import AsyncSingleFlight
+from dataclasses import replace
+from drawer.animation import is_animated
+from drawer.encoders import ANIMATED_FORMATS, OUTPUT_FORMATS, EncoderOptions
+from drawer.image_input import ImageTooLarge, open_image
+from drawer.warmup import WarmupRunner
+from drawer.render_worker import (
+    FrameBatchJob, RenderJob, bind_generator, init_worker, execute_job,
+    plan_animation, render_frame_batch, encode_animation_job
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """服务启动后在后台预渲染常用语，多进程模式下主进程已在fork前完成预渲染"""
+    if warmup_runner is not None and config.get("warmup_config.on_startup", True) and not warmup_runner.started:
+        warmup_runner.start()
+    yield
 
 # 创建FastAPI应用
 anan_sketchbook_app = FastAPI(
     title="Anan's Sketchbook API",
     description="安安的素描本聊天框API，用于生成带文本或图片的素描本图片。",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# 创建素描本生成器实例
+# 创建素描本生成器实例，线程池模式下渲染任务直接使用该实例
 sketchbook_gen = SketchbookGenerator()
+bind_generator(sketchbook_gen)
+
+# 常用语预渲染，清单位于data目录下
+warmup_runner = None
+if config.get("warmup_config.enabled", True):
+    warmup_runner = WarmupRunner(
+        sketchbook_gen,
+        os.path.join(internal_config.work_dir, "data", config.get("warmup_config.manifest_file", "warmup.toml"))
+    )
+
+# 创建渲染工作池，渲染任务不在事件循环中执行
+render_pool = RenderPool(
+    workers=config.get("render_config.workers", 0),
+    queue_size=config.get("render_config.queue_size", 64),
+    max_in_flight=config.get("render_config.max_in_flight", 0),
+    retry_after=config.get("render_config.retry_after_seconds", 1),
+    backend=config.get("render_config.backend", "thread"),
+    initializer=init_worker,
+    max_jobs_per_worker=config.get("render_config.max_jobs_per_worker", 1000),
+    start_method=config.get("render_config.start_method", "spawn"),
+    health_check_interval=config.get("render_config.health_check_interval", 30)
+)
+
+# 相同缓存键的文本渲染请求在提交到工作池之前合并，进程池模式下同样有效
+render_flights = AsyncSingleFlight()
 
 # 设置图片目录和域名配置
 IMAGE_FOLDER = os.path.join(internal_config.work_dir, "data", "sketchbooks")
@@ -35,10 +81,104 @@ PORT = config.get("api_port", 14541)
 # 确保图片目录存在
 os.makedirs(IMAGE_FOLDER, exist_ok=True)
 
+# 创建生成图片的存储后端
+IMAGE_RETENTION_SECONDS = config.get("file_config.temp_file_retention_seconds", 300)
+image_store = create_image_store(
+    backend=config.get("storage_config.backend", "disk"),
+    directory=IMAGE_FOLDER,
+    segment_directory=os.path.join(internal_config.work_dir, "data", "segments"),
+    retention_seconds=IMAGE_RETENTION_SECONDS,
+    max_bytes=config.get("storage_config.max_bytes", 256 * 1024 * 1024),
+    segment_size=config.get("storage_config.segment_size", 16 * 1024 * 1024)
+)
+
+# 上传图片的字节数和像素数上限，为0时不限制
+UPLOAD_MAX_BYTES = config.get("image_config.upload_max_bytes", 20 * 1024 * 1024)
+UPLOAD_MAX_PIXELS = config.get("image_config.upload_max_pixels", 50_000_000)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# multipart表单除文件内容之外的开销
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# 动图上传输出为动画，最大帧数不超过1时只使用第一帧
+ANIMATION_ENABLED = config.get("image_config.animation_max_frames", 60) > 1
+ANIMATION_FORMAT = config.get("image_config.animation_format", "webp")
+
 # 创建认证工具
 bearer_scheme = HTTPBearer(auto_error=False)
 api_key_header = APIKeyHeader(name="X-API-Token", auto_error=False)
 
+class UploadTooLarge(HTTPException):
+    """请求体超过上传字节数上限"""
+
+    def __init__(self):
+        super().__init__(status_code=413, detail=f"图片过大，最大允许{UPLOAD_MAX_BYTES}字节")
+
+class UploadLimitMiddleware:
+    """限制上传接口的请求体字节数
+
+    先按Content-Length拒绝；分块传输等没有Content-Length的请求在读取请求体时累计字节数，
+    超过上限时立即返回413，不会把整个请求体读入内存或写入临时文件。
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        # 路径 -> 请求体字节数上限
+        self.limits = limits
+
+    @staticmethod
+    async def reject(scope, receive, send) -> None:
+        response = JSONResponse(
+            status_code=413,
+            content={"success": False, "detail": f"图片过大，最大允许{UPLOAD_MAX_BYTES}字节"}
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await self.reject(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                # 在表单和JSON解析过程中抛出，由异常处理返回413
+                if received > limit:
+                    raise UploadTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadTooLarge:
+            if started:
+                raise
+            await self.reject(scope, receive, send)
+
+# 上传接口的请求体上限：multipart表单为图片字节数加表单开销，JSON接口为Base64编码后的长度加其他字段的开销
+if UPLOAD_MAX_BYTES > 0:
+    base64_body_limit = (UPLOAD_MAX_BYTES + 2) // 3 * 4 + UPLOAD_FORM_OVERHEAD
+    anan_sketchbook_app.add_middleware(UploadLimitMiddleware, limits={
+        f"{config.get('api_route')}/generate/image": UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD,
+        f"{config.get('api_route')}/generate/base64": base64_body_limit,
+        f"{config.get('api_route')}/generate/raw": base64_body_limit,
+        f"{config.get('api_route')}/generate/batch": base64_body_limit
+    })
+
 # 创建认证类
 class AuthManager:
     @staticmethod
@@ -104,23 +244,188 @@ def require_authentication():
     
     return dependency
 
+async def run_render(func, *args, **kwargs):
+    """将渲染任务提交到工作池，队列已满时返回503"""
+    try:
+        return await render_pool.run(func, *args, **kwargs)
+    except RenderPoolFull as e:
+        log.warning("渲染队列已满，拒绝请求")
+        raise HTTPException(
+            status_code=503,
+            detail="服务繁忙，请稍后重试",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+def text_cache_key(text: str, output_format: Optional[str]) -> Optional[str]:
+    """文本渲染请求的缓存键"""
+    return sketchbook_gen.render_cache_key(sketchbook_gen.build_spec(text=text, output_format=output_format))
+
+async def render_text(text: str, encoder: EncoderOptions) -> RenderOutput:
+    """渲染文本，缓存键相同的并发请求只提交一次渲染任务并共享结果"""
+    job = RenderJob(text=text, output_format=encoder.format)
+    # 解析表情标签可能重新扫描表情包目录，首次计算资源摘要需要读取文件，不在事件循环中进行
+    key = await asyncio.to_thread(text_cache_key, text, encoder.format)
+    return await render_flights.do(key, lambda: run_render(execute_job, job))
+
+def upload_too_large() -> HTTPException:
+    return UploadTooLarge()
+
+async def read_upload(upload: UploadFile) -> bytes:
+    """分块读取上传文件，超过字节数上限时立即停止"""
+    chunks = []
+    total = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if UPLOAD_MAX_BYTES > 0 and total > UPLOAD_MAX_BYTES:
+            raise upload_too_large()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def check_image(img_data: bytes, error_prefix: str = "无效的图片") -> bool:
+    """只解析图片头，校验格式和像素数，不解码像素；返回是否按动图处理"""
+    try:
+        return ANIMATION_ENABLED and is_animated(open_image(img_data, UPLOAD_MAX_PIXELS))
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"{error_prefix}: {str(e)}")
+
+def decode_base64_image(image_base64: str) -> Tuple[bytes, bool]:
+    """解码并校验Base64图片，按编码长度提前拒绝过大的图片；返回（图片数据，是否为动图）"""
+    if UPLOAD_MAX_BYTES > 0 and len(image_base64) * 3 // 4 > UPLOAD_MAX_BYTES + 2:
+        raise upload_too_large()
+    try:
+        img_data = base64.b64decode(image_base64)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"无效的Base64图片: {str(e)}")
+    if UPLOAD_MAX_BYTES > 0 and len(img_data) > UPLOAD_MAX_BYTES:
+        raise upload_too_large()
+    animated = check_image(img_data, "无效的Base64图片")
+    return img_data, animated
+
+def make_filename(prefix: str, extension: str = "png") -> str:
+    """生成带时间戳的唯一文件名"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    random_id = uuid.uuid4().hex[:6]
+    return f"{prefix}_{timestamp}_{random_id}.{extension}"
+
+def parse_accept(header: str) -> Dict[str, float]:
+    """解析Accept头，返回媒体类型到q值的映射"""
+    ranges: Dict[str, float] = {}
+    for part in header.split(","):
+        media_type, *params = part.split(";")
+        media_type = media_type.strip().lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        ranges[media_type] = max(q, ranges.get(media_type, 0.0))
+    return ranges
+
+def accepts_image(request: Request) -> bool:
+    """判断客户端是否通过Accept头要求直接返回图片
+
+    只有图片类型的q值高于JSON和其他非图片类型时才返回图片，浏览器默认的Accept头
+    （text/html优先）以及*/*仍然返回JSON。
+    """
+    ranges = parse_accept(request.headers.get("accept", ""))
+    image_q = max((q for media_type, q in ranges.items() if media_type.startswith("image/")), default=0.0)
+    other_q = max((q for media_type, q in ranges.items() if not media_type.startswith("image/")), default=0.0)
+    return image_q > 0 and image_q > other_q
+
+def negotiate_encoder(request: Optional[Request], output_format: Optional[str]) -> EncoderOptions:
+    """确定输出编码：请求中指定的格式优先，其次按Accept头选择，都没有时使用配置的默认格式"""
+    if output_format:
+        if output_format not in OUTPUT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的输出格式: {output_format}")
+        return sketchbook_gen.encoder.with_format(output_format)
+    ranges = parse_accept(request.headers.get("accept", "")) if request is not None else {}
+    # 选择q值最高的图片格式，与默认格式同为最高时使用默认格式
+    candidates = {fmt: ranges.get(OUTPUT_FORMATS[fmt]["media_type"], 0.0) for fmt in ("png", "webp", "jpeg", "gif")}
+    best = max(candidates.values())
+    if best > 0 and ranges.get(sketchbook_gen.encoder.media_type, 0.0) < best:
+        return sketchbook_gen.encoder.with_format(next(fmt for fmt, q in candidates.items() if q == best))
+    return sketchbook_gen.encoder
+
+def animation_encoder(encoder: EncoderOptions) -> EncoderOptions:
+    """动图输出使用支持动画的格式，请求的格式不支持动画时改用配置的动图格式"""
+    if encoder.format in ANIMATED_FORMATS:
+        return encoder
+    return encoder.with_format(ANIMATION_FORMAT)
+
+async def render_upload(img_data: bytes, animated: bool, encoder: EncoderOptions) -> Tuple[RenderOutput, EncoderOptions]:
+    """渲染上传的图片，返回（渲染结果，实际使用的编码参数）
+
+    动图先在工作池中解码、合并相同帧，再把各帧分批并行渲染重绘区域，最后合成并编码。
+    """
+    if not animated:
+        return await run_render(execute_job, RenderJob(image_bytes=img_data, output_format=encoder.format)), encoder
+    
+    encoder = animation_encoder(encoder)
+    plan = await run_render(plan_animation, RenderJob(image_bytes=img_data, output_format=encoder.format))
+    if plan.result is not None:
+        return RenderOutput(plan.result, encoder.extension, plan.cache_key), encoder
+    
+    batch_count = max(min(render_pool.workers, len(plan.frames)), 1)
+    batch_size = -(-len(plan.frames) // batch_count)
+    batches = await asyncio.gather(*(
+        run_render(render_frame_batch, FrameBatchJob(
+            image_file=plan.image_file,
+            overlay_file=plan.overlay_file,
+            frames=plan.frames[i:i + batch_size]
+        ))
+        for i in range(0, len(plan.frames), batch_size)
+    ))
+    tiles = [tile for batch in batches for tile in batch]
+    # 编码时不再需要原始帧，避免重复传给工作进程
+    output = await run_render(encode_animation_job, replace(plan, frames=()), tiles)
+    return output, encoder
+
+def image_response(image_bytes: bytes, filename: str, media_type: str) -> Response:
+    """直接以图片二进制作为响应体返回，不落盘也不做Base64编码"""
+    return Response(
+        content=image_bytes,
+        media_type=media_type,
+        headers={"Content-Disposition": f'inline; filename="{filename}"'}
+    )
+
 # 定义请求体模型
+OutputFormat = Literal["png", "png8", "webp", "jpeg", "gif"]
+
 class TextGenerateRequest(BaseModel):
     """文本生成图片的请求体模型"""
     text: str = Field(..., description="要绘制的文本，可以包含表情标记（如#开心#、#生气#等，多个标记时只使用最后一个）")
+    output_format: Optional[OutputFormat] = Field(None, description="输出格式，为空时使用配置中的默认格式")
 
 class Base64GenerateRequest(BaseModel):
     """Base64生成图片的请求体模型"""
     text: Optional[str] = Field(None, description="要绘制的文本，可以包含表情标记（如#开心#、#生气#等，多个标记时只使用最后一个）")
     image_base64: Optional[str] = Field(None, description="Base64编码的图片，与text二选一")
+    output_format: Optional[OutputFormat] = Field(None, description="输出格式，为空时使用配置中的默认格式")
+
+class BatchGenerateRequest(BaseModel):
+    """批量生成图片的请求体模型"""
+    items: List[Base64GenerateRequest] = Field(..., description="要生成的图片列表，每项提供text或image_base64")
+    response_type: Literal["url", "base64"] = Field("url", description="返回图片URL或Base64编码")
+    stream: bool = Field(False, description="为true时以NDJSON流式返回，每完成一项输出一行")
 
 # 修改所有POST接口，使用JSON请求体
 @anan_sketchbook_app.post(f"{config.get('api_route')}/generate/text", tags=["生成图片"])
 async def generate_text_image(
     request: TextGenerateRequest,
+    http_request: Request,
     auth_result: Dict[str, Any] = Depends(require_authentication())
 ):
-    """根据文本生成素描本图片"""
+    """根据文本生成素描本图片，请求头Accept为图片类型时直接返回图片"""
     try:
         # 检查文本是否为空
         if not request.text.strip():
@@ -128,16 +433,15 @@ async def generate_text_image(
         
         # 生成图片
         log.info(f"生成文本图片: {request.text[:50]}...")
+        encoder = negotiate_encoder(http_request, request.output_format)
         # 不再传入emotion参数，表情标记从text中提取
-        png_bytes = sketchbook_gen.generate_sketchbook(text=request.text)
+        output = await render_text(request.text, encoder)
         
-        # 生成唯一的文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        random_id = uuid.uuid4().hex[:6]
-        filename = f"text_{timestamp}_{random_id}.png"
+        if accepts_image(http_request):
+            return image_response(output.data, make_filename("text", encoder.extension), encoder.media_type)
         
-        # 保存图片并启动删除线程
-        create_image_and_start_deletion(png_bytes, filename)
+        # 保存图片，相同的渲染结果只保存一份
+        filename = await publish_image(output, "text")
         
         # 返回图片URL
         img_url = build_full_url(DOMAIN, PORT, f"images/{filename}")
@@ -166,27 +470,29 @@ async def generate_text_image(
 # 但可以将其他参数放在JSON中传递
 @anan_sketchbook_app.post(f"{config.get('api_route')}/generate/image", tags=["生成图片"])
 async def generate_image_image(
+    http_request: Request,
     image: UploadFile = File(..., description="要粘贴的图片文件"),
+    output_format: Optional[str] = Form(None, description="输出格式：png、png8、webp、jpeg或gif，为空时使用配置中的默认格式；动图只能输出webp或gif"),
     auth_result: Dict[str, Any] = Depends(require_authentication())
 ):
-    """根据上传的图片生成素描本图片"""
+    """根据上传的图片生成素描本图片，请求头Accept为图片类型时直接返回图片"""
     try:
-        # 读取图片
-        image_data = await image.read()
-        img = Image.open(io.BytesIO(image_data))
+        encoder = negotiate_encoder(http_request, output_format)
+        
+        # 分块读取图片并校验图片头，解码在工作池中进行
+        image_data = await read_upload(image)
+        animated = check_image(image_data)
         
         # 生成图片
         log.info(f"生成图片: {image.filename}")
         # 不再传入emotion参数
-        png_bytes = sketchbook_gen.generate_sketchbook(image=img)
+        output, encoder = await render_upload(image_data, animated, encoder)
         
-        # 生成唯一的文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        random_id = uuid.uuid4().hex[:6]
-        filename = f"image_{timestamp}_{random_id}.png"
+        if accepts_image(http_request):
+            return image_response(output.data, make_filename("image", encoder.extension), encoder.media_type)
         
-        # 保存图片并启动删除线程
-        create_image_and_start_deletion(png_bytes, filename)
+        # 保存图片，相同的渲染结果只保存一份
+        filename = await publish_image(output, "image")
         
         # 返回图片URL
         img_url = build_full_url(DOMAIN, PORT, f"images/{filename}")
@@ -214,38 +520,40 @@ async def generate_image_image(
 @anan_sketchbook_app.post(f"{config.get('api_route')}/generate/base64", tags=["生成图片"])
 async def generate_base64_image(
     request: Base64GenerateRequest,
+    http_request: Request,
     auth_result: Dict[str, Any] = Depends(require_authentication())
 ):
-    """生成素描本图片并返回Base64编码"""
+    """生成素描本图片并返回Base64编码，请求头Accept为图片类型时直接返回图片"""
     try:
         # 检查参数
         if not request.text and not request.image_base64:
             raise HTTPException(status_code=400, detail="必须提供text或image_base64参数")
+        encoder = negotiate_encoder(http_request, request.output_format)
         
-        img = None
+        img_data = None
         if request.image_base64:
-            # 处理Base64图片
-            try:
-                img_data = base64.b64decode(request.image_base64)
-                img = Image.open(io.BytesIO(img_data))
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"无效的Base64图片: {str(e)}")
+            # 处理Base64图片，这里只校验图片头，解码在工作池中进行
+            img_data, animated = decode_base64_image(request.image_base64)
         
         # 生成图片
-        if img is not None:
+        if img_data is not None:
             log.info("生成Base64图片")
-            png_bytes = sketchbook_gen.generate_sketchbook(image=img)
+            output, encoder = await render_upload(img_data, animated, encoder)
         else:
             log.info(f"生成Base64文本图片: {request.text[:50]}...")
-            png_bytes = sketchbook_gen.generate_sketchbook(text=request.text)
+            output = await render_text(request.text, encoder)
+        image_bytes = output.data
+        
+        if accepts_image(http_request):
+            return image_response(image_bytes, make_filename("base64", encoder.extension), encoder.media_type)
         
         # 转换为Base64
-        base64_str = base64.b64encode(png_bytes).decode("utf-8")
+        base64_str = base64.b64encode(image_bytes).decode("utf-8")
         
         # 生成唯一的文件名（仅用于日志）
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         random_id = uuid.uuid4().hex[:6]
-        filename = f"base64_{timestamp}_{random_id}.png"
+        filename = f"base64_{timestamp}_{random_id}.{encoder.extension}"
         
         log.info(f"Base64图片已生成: {filename}")
         
@@ -256,7 +564,8 @@ async def generate_base64_image(
                 "message": "success",
                 "data": {
                     "base64": base64_str,
-                    "filename": filename
+                    "filename": filename,
+                    "media_type": encoder.media_type
                 }
             }
         )
@@ -268,34 +577,135 @@ async def generate_base64_image(
         log.error(f"生成Base64图片时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"生成Base64图片失败: {str(e)}")
 
-# 定时删除图片的函数
-def delete_file(path):
-    # 从配置中获取临时文件保留时间，默认300秒
-    retention_seconds = config.get("file_config.temp_file_retention_seconds", 300)
-    
-    # 如果保留时间为0，则禁用自动删除
-    if retention_seconds <= 0:
-        return
-    
-    time.sleep(retention_seconds)  # 等待指定秒数后删除
+@anan_sketchbook_app.post(
+    f"{config.get('api_route')}/generate/raw",
+    tags=["生成图片"],
+    response_class=Response,
+    responses={200: {"content": {"image/png": {}, "image/webp": {}, "image/jpeg": {}, "image/gif": {}}, "description": "图片"}}
+)
+async def generate_raw_image(
+    request: Base64GenerateRequest,
+    http_request: Request,
+    auth_result: Dict[str, Any] = Depends(require_authentication())
+):
+    """生成素描本图片并直接返回图片二进制内容"""
     try:
-        if os.path.exists(path):
-            os.remove(path)
-            log.info(f"已删除临时图片: {path}")
+        # 检查参数
+        if not request.text and not request.image_base64:
+            raise HTTPException(status_code=400, detail="必须提供text或image_base64参数")
+        encoder = negotiate_encoder(http_request, request.output_format)
+        
+        if request.image_base64:
+            # 处理Base64图片，这里只校验图片头，解码在工作池中进行
+            img_data, animated = decode_base64_image(request.image_base64)
+            log.info("生成图片")
+            output, encoder = await render_upload(img_data, animated, encoder)
+        else:
+            log.info(f"生成文本图片: {request.text[:50]}...")
+            output = await render_text(request.text, encoder)
+        
+        return image_response(output.data, make_filename("raw", encoder.extension), encoder.media_type)
+        
+    except HTTPException as e:
+        log.error(f"HTTP错误: {e.detail}")
+        raise e
+    except Exception as e:
+        log.error(f"生成图片时出错: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"生成图片失败: {str(e)}")
+
+async def render_batch_item(index: int, item: Base64GenerateRequest, response_type: str) -> Dict[str, Any]:
+    """渲染批量请求中的单项，失败时返回错误信息而不是中断整个批次"""
+    try:
+        encoder = negotiate_encoder(None, item.output_format)
+        if item.image_base64:
+            img_data, animated = decode_base64_image(item.image_base64)
+            output, encoder = await render_upload(img_data, animated, encoder)
+            prefix = "image"
+        elif item.text and item.text.strip():
+            output = await render_text(item.text, encoder)
+            prefix = "text"
+        else:
+            raise HTTPException(status_code=400, detail="必须提供text或image_base64参数")
+        
+        if response_type == "base64":
+            filename = make_filename(prefix, encoder.extension)
+            result = {"base64": base64.b64encode(output.data).decode("utf-8"), "media_type": encoder.media_type}
+        else:
+            filename = await publish_image(output, prefix)
+            result = {"img_url": build_full_url(DOMAIN, PORT, f"images/{filename}")}
+        return {"index": index, "success": True, "filename": filename, **result}
+    
+    except HTTPException as e:
+        return {"index": index, "success": False, "status_code": e.status_code, "detail": e.detail}
     except Exception as e:
-        log.error(f"删除临时图片失败: {e}")
-
-# 创建图片并启动删除线程
-def create_image_and_start_deletion(image_bytes, image_name):
-    # 保存图片
-    image_path = os.path.join(IMAGE_FOLDER, image_name)
-    with open(image_path, "wb") as f:
-        f.write(image_bytes)
+        log.error(f"批量生成第{index}项时出错: {str(e)}")
+        return {"index": index, "success": False, "status_code": 500, "detail": f"生成图片失败: {str(e)}"}
+
+@anan_sketchbook_app.post(f"{config.get('api_route')}/generate/batch", tags=["生成图片"])
+async def generate_batch_images(
+    request: BatchGenerateRequest,
+    auth_result: Dict[str, Any] = Depends(require_authentication())
+):
+    """批量生成素描本图片，各项在工作池中并行渲染"""
+    max_items = config.get("render_config.max_batch_items", 50)
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items不能为空")
+    if len(request.items) > max_items:
+        raise HTTPException(status_code=400, detail=f"单次最多生成{max_items}张图片")
     
-    # 启动删除线程
-    threading.Thread(target=delete_file, args=(image_path,)).start()
+    log.info(f"批量生成图片: {len(request.items)}项")
+    tasks = [
+        asyncio.ensure_future(render_batch_item(i, item, request.response_type))
+        for i, item in enumerate(request.items)
+    ]
     
-    return image_path
+    if request.stream:
+        async def stream_results():
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    result = await finished
+                    yield json.dumps(result, ensure_ascii=False) + "\n"
+            finally:
+                # 客户端提前断开时取消尚未完成的渲染
+                for task in tasks:
+                    task.cancel()
+        
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+    
+    results = await asyncio.gather(*tasks)
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": {
+                "items": results
+            }
+        }
+    )
+
+async def publish_image(output: RenderOutput, prefix: str) -> str:
+    """保存图片并返回文件名
+
+    可缓存的结果保存在磁盘渲染缓存中，以缓存键命名，相同的渲染结果只保存一份；
+    其他结果以带时间戳的文件名写入存储后端，过期后自动删除。
+    """
+    disk_cache = sketchbook_gen.disk_cache
+    if output.cache_key is not None and disk_cache is not None:
+        # 工作进程通常已经写入，这里只确认文件仍在缓存中并更新访问时间
+        filename = await asyncio.to_thread(disk_cache.put, output.cache_key, output.data, output.extension)
+        if filename is not None:
+            return filename
+    filename = make_filename(prefix, output.extension)
+    await save_image(output.data, filename)
+    return filename
+
+# 保存图片到存储后端，过期后由存储后端自动清理
+async def save_image(image_bytes, image_name):
+    if image_store.backend == "disk":
+        await asyncio.to_thread(image_store.put, image_name, image_bytes)
+    else:
+        image_store.put(image_name, image_bytes)
 
 # 构建完整URL的函数
 def build_full_url(domain, port, path):
@@ -310,13 +720,14 @@ def build_full_url(domain, port, path):
 async def get_emotions(
     auth_result: Dict[str, Any] = Depends(require_authentication())
 ):
-    """获取所有可用的表情差分"""
+    """获取所有可用的表情差分，以及各表情包是否常驻内存"""
     try:
         # 返回表情差分列表
         emotions = list(sketchbook_gen.BASEIMAGE_MAPPING.keys())
         return {
             "success": True,
-            "emotions": emotions
+            "emotions": emotions,
+            "packs": sketchbook_gen.emotions.packs()
         }
         
     except HTTPException as e:
@@ -326,6 +737,33 @@ async def get_emotions(
         log.error(f"获取表情列表时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取表情列表失败: {str(e)}")
 
+@anan_sketchbook_app.post(f"{config.get('api_route')}/admin/warmup", tags=["系统管理"])
+async def trigger_warmup(
+    auth_result: Dict[str, Any] = Depends(require_authentication())
+):
+    """重新读取预渲染清单并在后台预渲染"""
+    if warmup_runner is None:
+        raise HTTPException(status_code=400, detail="常用语预渲染未启用")
+    started = warmup_runner.start()
+    return {
+        "success": True,
+        "started": started,
+        "warmup": warmup_runner.status()
+    }
+
+@anan_sketchbook_app.get(f"{config.get('api_route')}/admin/warmup", tags=["系统管理"])
+async def get_warmup_status(
+    auth_result: Dict[str, Any] = Depends(require_authentication())
+):
+    """获取预渲染进度"""
+    if warmup_runner is None:
+        raise HTTPException(status_code=400, detail="常用语预渲染未启用")
+    return {
+        "success": True,
+        "warmup": warmup_runner.status(),
+        "disk_cache": sketchbook_gen.disk_cache.stats() if sketchbook_gen.disk_cache else None
+    }
+
 @anan_sketchbook_app.get(f"{config.get('api_route')}/status", tags=["系统信息"])
 async def get_status():
     """获取系统状态（无需认证）"""
@@ -334,11 +772,50 @@ async def get_status():
         "app": "Anan's Sketchbook API",
         "version": "1.0.0",
         "status": "running",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "assets": sketchbook_gen.assets.stats(),
+        "compositor": sketchbook_gen.compositor.stats(),
+        "emotions": sketchbook_gen.emotions.stats(),
+        "render_cache": sketchbook_gen.render_cache.stats() if sketchbook_gen.render_cache else None,
+        "disk_cache": sketchbook_gen.disk_cache.stats() if sketchbook_gen.disk_cache else None,
+        "single_flight": render_flights.stats(),
+        "render_single_flight": sketchbook_gen.flights.stats(),
+        "thumbnail_cache": sketchbook_gen.thumbnails.stats() if sketchbook_gen.thumbnails else None,
+        "render_pool": render_pool.stats(),
+        "image_store": image_store.stats(),
+        "log": log.stats(),
+        "process": process_stats()
     }
 
-# 挂载静态目录提供图片访问
-anan_sketchbook_app.mount("/images", StaticFiles(directory=IMAGE_FOLDER), name="images")
+# 提供图片访问：磁盘渲染缓存中的图片以缓存键命名，优先从缓存返回；
+# 其他图片磁盘后端从静态目录返回，内存和映射文件后端直接返回数据
+image_files = StaticFiles(directory=IMAGE_FOLDER) if image_store.backend == "disk" else None
+cached_files = StaticFiles(directory=sketchbook_gen.disk_cache.objects_dir) if sketchbook_gen.disk_cache else None
+
+@anan_sketchbook_app.api_route("/images/{filename}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_image(filename: str, request: Request):
+    if cached_files is not None:
+        path = await asyncio.to_thread(sketchbook_gen.disk_cache.open_file, filename)
+        if path is not None:
+            try:
+                return cached_files.file_response(path, os.stat(path), request.scope)
+            except FileNotFoundError:
+                # 刚被其他进程淘汰
+                pass
+    if image_files is not None:
+        return await image_files.get_response(filename, request.scope)
+    stored = image_store.get(filename)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="图片不存在或已过期")
+    headers = {
+        "ETag": stored.etag,
+        "Cache-Control": f"public, max-age={max(int(IMAGE_RETENTION_SECONDS), 0)}"
+    }
+    if request.headers.get("if-none-match") == stored.etag:
+        return Response(status_code=304, headers=headers)
+    # mmap后端的数据直接从映射中发送，发送完后释放对段文件的引用
+    background = BackgroundTask(stored.data.release) if isinstance(stored.data, memoryview) else None
+    return Response(content=stored.data, media_type=stored.media_type, headers=headers, background=background)
 
 # 错误处理
 @anan_sketchbook_app.exception_handler(404)
@@ -0,0 +1,277 @@
+"""性能基准测试
+
+用法: python benchmark.py [layout] [fontsize] [encode] [pngrows] [stress]
+"""
+import sys
+import time
+import random
+from typing import Callable, Dict
+from PIL import Image, ImageDraw, ImageFont
+
+
+def _timeit(func: Callable[[], object], repeat: int = 5) -> float:
+    """返回多次运行中最快一次的耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _legacy_wrap_lines(draw: ImageDraw.ImageDraw, txt: str, font: ImageFont.FreeTypeFont, max_w: int) -> list:
+    """原draw_text_auto中逐次调用textlength的换行实现，用作对照"""
+    lines = []
+    for para in txt.splitlines() or [""]:
+        has_space = (" " in para)
+        units = para.split(" ") if has_space else list(para)
+        buf = ""
+
+        def unit_join(a: str, b: str) -> str:
+            if not a:
+                return b
+            return (a + " " + b) if has_space else (a + b)
+
+        for u in units:
+            trial = unit_join(buf, u)
+            w = draw.textlength(trial, font=font)
+            if w <= max_w:
+                buf = trial
+            else:
+                if buf:
+                    lines.append(buf)
+                if has_space and len(u) > 1:
+                    tmp = ""
+                    for ch in u:
+                        if draw.textlength(tmp + ch, font=font) <= max_w:
+                            tmp += ch
+                        else:
+                            if tmp:
+                                lines.append(tmp)
+                            tmp = ch
+                    buf = tmp
+                else:
+                    if draw.textlength(u, font=font) <= max_w:
+                        buf = u
+                    else:
+                        lines.append(u)
+                        buf = ""
+        if buf != "":
+            lines.append(buf)
+        if para == "" and (not lines or lines[-1] != ""):
+            lines.append("")
+    return lines
+
+
+def bench_layout() -> None:
+    """对比逐次textlength换行与增量排版引擎的耗时和换行结果"""
+    from drawer.sketchbook_drawer import SketchbookGenerator
+    from drawer.text_layout import TextLayoutEngine
+
+    gen = SketchbookGenerator()
+    region_w = gen.IMAGE_BOX_BOTTOMRIGHT[0] - gen.TEXT_BOX_TOPLEFT[0]
+    draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    min_size, max_size = gen.font_size_limits()
+    # 二分查找实际会尝试的字号
+    sizes = [38, 25, 18, 15, 13, 12]
+
+    rng = random.Random(0)
+    words = ["hello", "world", "sketchbook", "安安", "素描本", "[紫色]", "AVAWAY", "typography", "的", "了"]
+    samples: Dict[str, str] = {
+        "中文600字": "".join(rng.choice("安安的素描本今天天气很好我们一起去散步吧【重要】") for _ in range(600)),
+        "英文600字": " ".join(rng.choice(words) for _ in range(100))[:600],
+        "混合1000字": " ".join(rng.choice(words) for _ in range(200))[:1000],
+    }
+
+    # 换行结果一致性检查
+    engine = TextLayoutEngine()
+    mismatches = 0
+    for text in samples.values():
+        for size in range(min_size, max_size + 1):
+            font = gen.fonts.get(size)
+            if engine.wrap_lines(text, font, region_w) != _legacy_wrap_lines(draw, text, font, region_w):
+                mismatches += 1
+    print(f"换行结果不一致的组合数: {mismatches}")
+
+    print(f"{'样本':<10}{'原实现(ms)':>14}{'排版引擎(ms)':>16}{'加速比':>10}")
+    for name, text in samples.items():
+        fonts = [gen.fonts.get(size) for size in sizes]
+        legacy = _timeit(lambda: [_legacy_wrap_lines(draw, text, f, region_w) for f in fonts], repeat=3)
+        # 每次使用新的引擎，计入建立字形步进表的开销
+        cold = _timeit(lambda: [TextLayoutEngine().wrap_lines(text, f, region_w) for f in fonts], repeat=3)
+        warm = _timeit(lambda: [engine.wrap_lines(text, f, region_w) for f in fonts])
+        print(f"{name:<10}{legacy * 1000:>14.2f}{cold * 1000:>10.2f}/{warm * 1000:<5.2f}{legacy / cold:>9.1f}x")
+    print("排版引擎耗时为 冷缓存/热缓存，加速比按冷缓存计算")
+
+
+def bench_fontsize() -> None:
+    """对比二分查找与预测式字号求解的精确换行次数和耗时"""
+    from drawer.sketchbook_drawer import SketchbookGenerator
+    from drawer.text_layout import FontSizeSolver
+
+    gen = SketchbookGenerator()
+    region_w = gen.IMAGE_BOX_BOTTOMRIGHT[0] - gen.TEXT_BOX_TOPLEFT[0]
+    region_h = gen.IMAGE_BOX_BOTTOMRIGHT[1] - gen.TEXT_BOX_TOPLEFT[1]
+    min_size, _ = gen.font_size_limits()
+    max_size = gen.TEXT_RENDER_OPTIONS["max_font_height"]
+    line_spacing = 0.15
+
+    rng = random.Random(0)
+    words = ["hello", "早上好", "安安", "sketchbook", "[紫色]", "今天也要加油", "ok"]
+    texts = [" ".join(rng.choice(words) for _ in range(rng.choice([1, 3, 8, 20, 60]))) for _ in range(200)]
+
+    def binary_search(text: str) -> int:
+        wraps = 0
+        low, high = min_size, max_size
+        while low <= high:
+            mid = (low + high) // 2
+            font = gen.fonts.get(mid)
+            lines = gen.layout.wrap_lines(text, font, region_w)
+            wraps += 1
+            if len(lines) * font.size * (1 + line_spacing) <= region_h:
+                low = mid + 1
+            else:
+                high = mid - 1
+        return wraps
+
+    # 先预热字形步进表，只比较字号搜索本身
+    bs_wraps = sum(binary_search(t) for t in texts)
+    bs_time = _timeit(lambda: [binary_search(t) for t in texts], repeat=3)
+
+    solver = FontSizeSolver(gen.layout, gen.fonts.get, cache_size=0)
+    solver_time = _timeit(lambda: [solver.solve(t, region_w, region_h, min_size, max_size, line_spacing) for t in texts], repeat=3)
+    solver_wraps = solver.wraps / 3
+
+    memo = FontSizeSolver(gen.layout, gen.fonts.get)
+    for t in texts:
+        memo.solve(t, region_w, region_h, min_size, max_size, line_spacing)
+    memo_time = _timeit(lambda: [memo.solve(t, region_w, region_h, min_size, max_size, line_spacing) for t in texts])
+
+    n = len(texts)
+    print(f"{'方法':<12}{'平均换行次数':>12}{'平均耗时(ms)':>14}")
+    print(f"{'二分查找':<12}{bs_wraps / n:>12.2f}{bs_time / n * 1000:>14.3f}")
+    print(f"{'预测求解':<12}{solver_wraps / n:>12.2f}{solver_time / n * 1000:>14.3f}")
+    print(f"{'缓存命中':<12}{0:>12.2f}{memo_time / n * 1000:>14.3f}")
+
+
+def bench_encode() -> None:
+    """各编码参数在全部底图上的平均编码耗时和文件大小"""
+    from drawer.sketchbook_drawer import SketchbookGenerator
+    from drawer.encoders import EncoderOptions, encode_image
+
+    gen = SketchbookGenerator()
+    files = sorted({gen.DEFAULT_IMAGE_FILE, *gen.BASEIMAGE_MAPPING.values()})
+    images = [gen.assets.get(path) for path in files]
+
+    variants: Dict[str, EncoderOptions] = {
+        "png 默认(6)": EncoderOptions(),
+        "png level=1": EncoderOptions(png_compress_level=1),
+        "png level=9": EncoderOptions(png_compress_level=9),
+        "png optimize": EncoderOptions(png_optimize=True),
+        "png8": EncoderOptions(format="png8"),
+        "png8 level=1": EncoderOptions(format="png8", png_compress_level=1),
+        "webp 无损": EncoderOptions(format="webp", webp_lossless=True),
+        "webp 无损 m=0": EncoderOptions(format="webp", webp_lossless=True, webp_method=0),
+        "webp q=80": EncoderOptions(format="webp"),
+        "webp q=80 m=0": EncoderOptions(format="webp", webp_method=0),
+        "jpeg q=90": EncoderOptions(format="jpeg"),
+    }
+
+    print(f"底图数量: {len(images)}，尺寸: {images[0].size}")
+    print(f"{'编码参数':<16}{'平均耗时(ms)':>14}{'平均大小(KB)':>14}")
+    for name, options in variants.items():
+        sizes = [len(encode_image(img, options)) for img in images]
+        elapsed = _timeit(lambda: [encode_image(img, options) for img in images], repeat=3)
+        print(f"{name:<16}{elapsed / len(images) * 1000:>14.2f}{sum(sizes) / len(sizes) / 1024:>14.1f}")
+
+
+def bench_pngrows() -> None:
+    """对比完整PNG编码与静态扫描行缓存编码的耗时、大小和解码结果"""
+    import io
+    from drawer.sketchbook_drawer import SketchbookGenerator
+    from drawer.encoders import EncoderOptions, encode_image
+    from drawer.png_row_cache import PngRowCache
+
+    gen = SketchbookGenerator()
+    texts = ["#开心#早上好", "今天也要加油 [紫色] " * 12, "hello world " * 30]
+    overlay = gen.BASE_OVERLAY_FILE if gen.USE_BASE_OVERLAY else None
+    frame = gen.static_frame(gen.DEFAULT_IMAGE_FILE, overlay)
+    # 用画在素描本区域内的矩形模拟不同大小的重绘区域
+    x1, y1 = gen.TEXT_BOX_TOPLEFT
+    x2, y2 = gen.IMAGE_BOX_BOTTOMRIGHT
+    rects = {"素描本区域": None, "区域+字号余量": (x1 - 65, y1 - 65, x2 + 65, y2 + 65)}
+
+    def region(rect):
+        r = gen.compositor.region(frame, rect)
+        ImageDraw.Draw(r.tile).text((20, 20), texts[1], font=gen.fonts.get(24), fill=(0, 0, 0))
+        return r
+
+    print(f"{'重绘区域':<12}{'级别':>6}{'完整编码(ms)':>14}{'行缓存(ms)':>12}{'完整大小(KB)':>14}{'行缓存大小(KB)':>16}{'像素一致':>10}")
+    for name, rect in rects.items():
+        for level in (1, 6, 9):
+            cache = PngRowCache()
+            full = encode_image(region(rect).compose(), EncoderOptions(png_compress_level=level))
+            fast = cache.encode(region(rect), level)  # 首次调用建立并缓存静态分块
+            same = Image.open(io.BytesIO(full)).tobytes() == Image.open(io.BytesIO(fast)).tobytes()
+            full_time = _timeit(lambda: encode_image(region(rect).compose(), EncoderOptions(png_compress_level=level)), repeat=3)
+            fast_time = _timeit(lambda: cache.encode(region(rect), level), repeat=3)
+            print(f"{name:<12}{level:>6}{full_time * 1000:>14.2f}{fast_time * 1000:>12.2f}"
+                  f"{len(full) / 1024:>14.1f}{len(fast) / 1024:>16.1f}{str(same):>10}")
+
+
+def bench_stress(threads: int = 64, rounds: int = 3) -> None:
+    """多线程并发渲染不同表情的文本，检查每张图片与串行渲染的结果一致"""
+    import io
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from drawer.sketchbook_drawer import SketchbookGenerator
+
+    gen = SketchbookGenerator()
+    # 关闭渲染结果缓存，每个请求都实际渲染
+    gen.render_cache = None
+    gen.disk_cache = None
+    tags = ["", *gen.BASEIMAGE_MAPPING]
+    texts = [f"{tags[i % len(tags)]}第{i}条 [紫色] 并发渲染" for i in range(threads)]
+
+    def pixels(text: str) -> bytes:
+        return Image.open(io.BytesIO(gen.render(gen.build_spec(text=text)))).convert("RGBA").tobytes()
+
+    expected = {text: pixels(text) for text in texts}
+    barrier = threading.Barrier(threads)
+
+    def task(text: str) -> bool:
+        # 所有线程同时开始，尽量让渲染交错执行
+        barrier.wait()
+        return pixels(text) == expected[text]
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for index in range(rounds):
+            start = time.perf_counter()
+            results = list(executor.map(task, texts))
+            failures += results.count(False)
+            print(f"第{index + 1}轮: {threads}个线程，{len(tags)}种表情，"
+                  f"与串行结果不一致{results.count(False)}张，耗时{(time.perf_counter() - start) * 1000:.0f}ms")
+    if failures:
+        print(f"并发渲染结果错误: {failures}张")
+        sys.exit(1)
+    print("并发渲染结果与串行渲染一致")
+
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {
+    "layout": bench_layout,
+    "fontsize": bench_fontsize,
+    "encode": bench_encode,
+    "pngrows": bench_pngrows,
+    "stress": bench_stress,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"未知的基准测试: {name}，可选: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
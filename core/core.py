@@ -8,6 +8,7 @@ DEFAULT_CONFIG = {
     "api_route": "/api",
     "api_port": 14541,
     "api_host": "0.0.0.0",
+    "api_workers": 1,  # HTTP工作进程数
     "api_token": "",  # 留空表示不启用认证
     "domain": "localhost",
     # 使用相对路径配置资源路径
@@ -24,18 +25,90 @@ DEFAULT_CONFIG = {
         "#脸红#": "脸红.png",
         "#病娇#": "病娇.png"
     },
+    # 表情差分注册表配置
+    "emotion_config": {
+        "auto_discover": True,  # 自动发现图片目录中的表情和表情包
+        "check_interval": 2.0,  # 检查配置和目录变化的间隔（秒）
+        "memory_budget_bytes": 128 * 1024 * 1024  # 表情包常驻内存预算
+    },
     # 文本渲染配置
     "text_config": {
         "max_font_size": 96,  # 最大字体大小，上限96
-        "min_font_size": 12   # 最小字体大小，下限12
+        "min_font_size": 12,  # 最小字体大小，下限12
+        "preload_fonts": True,  # 启动时预热全部字号的字体对象
+        "layout_cache_size": 4096  # 缓存字号和换行结果的文本条数
     },
     # 图片渲染配置
     "image_config": {
-        "enable_sleeve_overlay": True  # 启用衣袖遮挡
+        "enable_sleeve_overlay": True,  # 启用衣袖遮挡
+        "asset_check_interval": 1.0,  # 底图文件变更检查间隔，单位为秒
+        "output_format": "png",  # 默认输出格式：png、png8、webp、jpeg或gif
+        "png_compress_level": 6,  # PNG压缩级别，0-9
+        "png_optimize": False,  # PNG额外压缩优化
+        "png_row_cache": True,  # PNG静态扫描行缓存
+        "png8_colors": 256,  # 调色板PNG的颜色数
+        "webp_lossless": False,  # WebP无损模式
+        "webp_quality": 80,  # WebP质量
+        "webp_method": 4,  # WebP编码方法，0-6
+        "jpeg_quality": 90,  # JPEG质量
+        "upload_max_bytes": 20 * 1024 * 1024,  # 上传图片字节数上限
+        "upload_max_pixels": 50_000_000,  # 上传图片像素数上限
+        "resize_reducing_gap": 3.0,  # 上传图片预缩小倍数
+        "animation_format": "webp",  # 动图输出格式
+        "animation_max_frames": 60,  # 动图最多解码的原始帧数，合并相同帧之前计数
+        "animation_max_duration_ms": 10000  # 动图最多处理的总时长（毫秒）
     },
     # 文件配置
     "file_config": {
         "temp_file_retention_seconds": 300  # 临时文件保留时间，单位为秒，为0时禁用
+    },
+    # 生成图片存储配置
+    "storage_config": {
+        "backend": "disk",  # 存储后端，disk、memory或mmap
+        "max_bytes": 268435456,  # memory和mmap后端的最大占用字节数
+        "segment_size": 16777216  # mmap后端单个段文件的大小
+    },
+    # 渲染结果缓存配置
+    "cache_config": {
+        "enabled": True,  # 启用渲染结果缓存
+        "max_entries": 1024,  # 最大缓存条目数
+        "max_bytes": 67108864,  # 最大缓存字节数
+        "ttl_seconds": 600,  # 缓存存活时间，单位为秒
+        "thumbnail_max_bytes": 32 * 1024 * 1024,  # 缩略图缓存内存上限
+        "perceptual_hash": False,  # 按感知哈希识别重新编码的图片
+        "perceptual_max_distance": 2,  # 感知哈希最大汉明距离
+        "disk_enabled": False,  # 启用磁盘渲染结果缓存，图片URL按内容命名且不受保留时间限制
+        "disk_max_bytes": 1024 * 1024 * 1024,  # 磁盘缓存最大字节数
+        "disk_max_entries": 65536  # 磁盘缓存最大条目数
+    },
+    # 日志配置
+    "log_config": {
+        "level": "INFO",  # 日志级别
+        "rotation": "size",  # 日志轮转方式，size、time或none
+        "max_bytes": 10 * 1024 * 1024,  # 按大小轮转时单个日志文件的最大字节数
+        "rotate_when": "midnight",  # 按时间轮转的周期
+        "backup_count": 7,  # 保留的历史日志文件数
+        "json_format": False,  # 输出JSON格式日志
+        "sample_rate": 1.0,  # INFO及以下级别日志的采样比例
+        "queue_size": 10000  # 等待写入的日志条数上限
+    },
+    # 常用语预渲染配置
+    "warmup_config": {
+        "enabled": True,  # 启用常用语预渲染
+        "on_startup": True,  # 启动后在后台预渲染
+        "manifest_file": "warmup.toml"  # 预渲染清单文件（data目录下）
+    },
+    # 渲染工作池配置
+    "render_config": {
+        "backend": "thread",  # 渲染后端，thread为线程池，process为多进程
+        "workers": 0,  # 渲染工作线程/进程数，为0时使用CPU核心数
+        "queue_size": 64,  # 最大排队任务数，超出时返回503
+        "max_in_flight": 0,  # 最大同时渲染数，为0时等于工作线程数
+        "retry_after_seconds": 1,  # 拒绝请求时Retry-After头的秒数
+        "max_jobs_per_worker": 1000,  # 工作进程执行多少个任务后替换，为0时不替换
+        "start_method": "spawn",  # 工作进程启动方式，spawn或forkserver
+        "health_check_interval": 30,  # 工作进程健康检查间隔，单位为秒，为0时禁用
+        "max_batch_items": 50  # 批量接口单次最多生成的图片数
     }
 }
 
@@ -59,7 +132,15 @@ resource_paths = {
 
 log = Logos(
     name="AnanSketchbook",
-    log_file=os.path.join(log_path, "app.log")
+    log_file=os.path.join(log_path, "app.log"),
+    level=config.get("log_config.level", "INFO"),
+    rotation=config.get("log_config.rotation", "size"),
+    max_bytes=config.get("log_config.max_bytes", 10 * 1024 * 1024),
+    rotate_when=config.get("log_config.rotate_when", "midnight"),
+    backup_count=config.get("log_config.backup_count", 7),
+    json_format=config.get("log_config.json_format", False),
+    sample_rate=config.get("log_config.sample_rate", 1.0),
+    queue_size=config.get("log_config.queue_size", 10000)
 )
 
 # 确保必要的目录存在
@@ -78,6 +159,7 @@ project_name = "Anan's Sketchbook API"
 api_route = "/api"  # API路由前缀
 api_port = 14541  # API监听端口
 api_host = "0.0.0.0"  # API监听地址
+api_workers = 1  # HTTP工作进程数，大于1时主进程预加载字体和底图后fork出多个工作进程共享监听端口，为0时使用CPU核心数
 api_token = ""  # API认证令牌，留空表示不启用认证
 domain = "localhost"  # 域名，用于生成回调URL
 
@@ -95,23 +177,97 @@ font_file = "fonts/font.ttf"  # 字体文件路径
 "#脸红#" = "脸红.png"  # 脸红表情
 "#病娇#" = "病娇.png"  # 病娇表情
 
+# 表情差分注册表配置
+[emotion_config]
+auto_discover = true  # 自动发现BaseImages中的图片：根目录图片注册为#文件名#，子目录作为表情包注册为#表情包/文件名#
+check_interval = 2.0  # 检查配置文件和图片目录变化的间隔，单位为秒，变化后无需重启即可生效
+memory_budget_bytes = 134217728  # 子目录表情包常驻内存的预算，超出时释放最久未使用的表情包，为0时不限制
+
 # 文本渲染配置
 [text_config]
 max_font_size = 96  # 最大字体大小，上限96
 min_font_size = 12  # 最小字体大小，下限12
+preload_fonts = true  # 启动时预热全部字号的字体对象
+layout_cache_size = 4096  # 缓存字号和换行结果的文本条数
 
 # 图片渲染配置
 [image_config]
 enable_sleeve_overlay = true  # 启用衣袖遮挡
+asset_check_interval = 1.0  # 底图文件变更检查间隔，单位为秒，为0时每次请求都检查
+output_format = "png"  # 默认输出格式：png、png8（调色板量化）、webp、jpeg或gif，请求中可单独指定
+png_compress_level = 6  # PNG的zlib压缩级别，0-9，越小编码越快、文件越大
+png_optimize = false  # PNG额外压缩优化，文件略小但编码明显变慢
+png_row_cache = true  # 缓存每张底图静态部分已压缩的扫描行，PNG输出只压缩素描本区域所在的行
+png8_colors = 256  # 调色板PNG的颜色数
+webp_lossless = false  # WebP无损模式
+webp_quality = 80  # WebP质量，无损模式下表示压缩力度
+webp_method = 4  # WebP编码方法，0最快，6压缩率最高
+jpeg_quality = 90  # JPEG质量
+upload_max_bytes = 20971520  # 上传图片的字节数上限，超过时返回413，为0时不限制
+upload_max_pixels = 50000000  # 上传图片的像素数上限，只读取图片头判断，超过时返回413，为0时不限制
+resize_reducing_gap = 3.0  # 缩放上传图片前先按整数倍缩小到目标尺寸的该倍数左右，JPEG直接以缩小后的尺寸解码，为0时关闭
+animation_format = "webp"  # 上传GIF/WebP动图时的输出格式，webp或gif；请求的格式支持动画时优先使用请求的格式
+animation_max_frames = 60  # 动图最多解码的原始帧数（合并相同帧之前），超出部分截断；为1时只使用第一帧
+animation_max_duration_ms = 10000  # 动图最多处理的总时长，单位为毫秒，超出部分截断，为0时不限制
 
 # 文件配置
 [file_config]
 temp_file_retention_seconds = 300  # 临时文件保留时间，单位为秒，为0时禁用
+
+# 生成图片存储配置
+[storage_config]
+backend = "disk"  # 存储后端，disk为写入data/sketchbooks，memory为内存，mmap为内存映射的段文件
+max_bytes = 268435456  # memory和mmap后端的最大占用字节数
+segment_size = 16777216  # mmap后端单个段文件的大小
+
+# 渲染结果缓存配置
+[cache_config]
+enabled = true  # 启用渲染结果缓存
+max_entries = 1024  # 最大缓存条目数
+max_bytes = 67108864  # 最大缓存字节数
+ttl_seconds = 600  # 缓存存活时间，单位为秒，为0时不过期
+thumbnail_max_bytes = 33554432  # 已缩放内容图片（缩略图）缓存的内存上限，为0时关闭
+perceptual_hash = false  # 按dHash识别被聊天软件重新编码的同一张图片，命中时复用缩略图和渲染结果
+perceptual_max_distance = 2  # 视为同一张图片的dHash最大汉明距离，0-3
+disk_enabled = false  # 启用磁盘渲染结果缓存（data/render_cache），多个进程和重启之间共享；图片URL改为按内容命名，在被淘汰前一直可以访问，不受temp_file_retention_seconds限制
+disk_max_bytes = 1073741824  # 磁盘缓存的最大字节数，超出时按最近访问时间淘汰
+disk_max_entries = 65536  # 磁盘缓存的最大条目数
+
+# 日志配置
+[log_config]
+level = "INFO"  # 日志级别：DEBUG、INFO、WARNING、ERROR或CRITICAL
+rotation = "size"  # data/log/app.log的轮转方式：size按大小，time按时间，none不轮转
+max_bytes = 10485760  # 按大小轮转时单个日志文件的最大字节数
+rotate_when = "midnight"  # 按时间轮转的周期，如midnight（每天零点）、H（每小时）
+backup_count = 7  # 保留的历史日志文件数
+json_format = false  # 每条日志输出为一行JSON，便于日志系统采集
+sample_rate = 1.0  # INFO及以下级别日志的采样比例，0-1，警告和错误始终记录
+queue_size = 10000  # 等待写入的日志条数上限，写入跟不上时丢弃新日志而不阻塞请求
+
+# 常用语预渲染配置
+[warmup_config]
+enabled = true  # 启用常用语预渲染
+on_startup = true  # 服务启动后在后台按清单预渲染
+manifest_file = "warmup.toml"  # 预渲染清单文件，位于data目录下
+
+# 渲染工作池配置
+[render_config]
+backend = "thread"  # 渲染后端，thread为线程池，process为多进程
+workers = 0  # 渲染工作线程/进程数，为0时使用CPU核心数
+queue_size = 64  # 最大排队任务数，超出时返回503
+max_in_flight = 0  # 最大同时渲染数，为0时等于工作线程数
+retry_after_seconds = 1  # 拒绝请求时Retry-After头的秒数
+max_jobs_per_worker = 1000  # 工作进程执行多少个任务后替换，为0时不替换
+start_method = "spawn"  # 工作进程启动方式，spawn或forkserver
+health_check_interval = 30  # 工作进程健康检查间隔，单位为秒，为0时禁用
+max_batch_items = 50  # 批量接口单次最多生成的图片数
 """
-    # 直接写入带注释的配置文件
+    # 先写入临时文件再替换，多个进程同时首次启动时不会读到写了一半的配置文件
     try:
-        with open(config_file, 'w', encoding='utf-8') as f:
+        temp_file = f"{config_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
             f.write(config_template)
+        os.replace(temp_file, config_file)
         # 重新加载配置
         config.load()
     except Exception as e:
@@ -119,12 +275,12 @@ temp_file_retention_seconds = 300  # 临时文件保留时间，单位为秒，
         # 回退到默认的配置合并逻辑
         for key, value in DEFAULT_CONFIG.items():
             if config.get(key) is None:
-                config.set(key, value)
+                config.set(key, value, save=False)
 else:
-    # 合并默认配置和用户配置 - 只写入相对路径配置
+    # 合并默认配置和用户配置 - 只在内存中合并，启动时不改写用户的配置文件
     for key, value in DEFAULT_CONFIG.items():
         if config.get(key) is None:
-            config.set(key, value)
+            config.set(key, value, save=False)
 
 # 为了保持向后兼容性，创建一个包含绝对路径的内部配置对象
 class InternalConfig:
@@ -0,0 +1,329 @@
+import os
+import re
+import mmap
+import time
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from core.core import log
+
+try:
+    import fcntl
+except ImportError:
+    # Windows没有flock，改用msvcrt对锁文件的第一个字节加锁，只支持独占锁
+    fcntl = None
+    import msvcrt
+
+# 索引文件头：魔数、槽位数、保留、条目数、总字节数、删除标记数
+_HEADER = struct.Struct("<8sII3Q")
+_HEADER_SIZE = 64
+_MAGIC = b"ANSKIDX1"
+# 槽位：状态、扩展名编号、文件大小、最近访问时间（秒）、缓存键
+_SLOT = struct.Struct("<BB2xII32s4x")
+_EMPTY, _USED, _DELETED = 0, 1, 2
+_EXTENSIONS = ("png", "webp", "jpg", "gif")
+_NAME_PATTERN = re.compile(r"^([0-9a-f]{64})\.([a-z]+)$")
+
+
+class DiskRenderCache:
+    """磁盘上的二级渲染结果缓存，可在多个进程和重启之间共享
+
+    图片以缓存键（输入内容的SHA-256）命名，写入临时文件后原子替换；索引是映射到内存的
+    开放寻址哈希表，记录每个文件的大小和最近访问时间。多个进程通过文件锁互斥修改索引，
+    总字节数或条目数超出上限时按最近访问时间淘汰。索引损坏或容量配置变化时根据目录中
+    已有的文件重建。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024, max_entries: int = 65536):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        self.index_file = os.path.join(directory, "index.bin")
+        self.lock_file = os.path.join(directory, "index.lock")
+        self.max_bytes = max_bytes
+        self.max_entries = max(max_entries, 16)
+        # 槽位数为2的幂，装载率不超过3/4
+        self.capacity = 1 << (self.max_entries * 4 // 3).bit_length()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_fd = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._locked(exclusive=True):
+            self._map = self._open_index()
+
+    # ---- 锁与索引文件 ----
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        """线程锁加文件锁；fork后的子进程重新打开锁文件，不与父进程共享同一个锁"""
+        with self._lock:
+            if self._pid != os.getpid():
+                if self._lock_fd is not None:
+                    os.close(self._lock_fd)
+                self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+            self._lock_file(exclusive)
+            try:
+                yield
+            finally:
+                self._unlock_file()
+
+    def _lock_file(self, exclusive: bool) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            return
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                # LK_LOCK重试10秒后仍未获得锁时抛出OSError，继续等待
+                msvcrt.locking(self._lock_fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def _unlock_file(self) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            return
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        msvcrt.locking(self._lock_fd, msvcrt.LK_UNLCK, 1)
+
+    def _open_index(self) -> mmap.mmap:
+        size = _HEADER_SIZE + self.capacity * _SLOT.size
+        fd = os.open(self.index_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            valid = os.fstat(fd).st_size == size
+            if valid:
+                index_map = mmap.mmap(fd, size)
+                magic, capacity = _HEADER.unpack_from(index_map, 0)[:2]
+                valid = magic == _MAGIC and capacity == self.capacity
+                if not valid:
+                    index_map.close()
+            if not valid:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                index_map = mmap.mmap(fd, size)
+                _HEADER.pack_into(index_map, 0, _MAGIC, self.capacity, 0, 0, 0, 0)
+                self._rebuild_from_files(index_map)
+        finally:
+            os.close(fd)
+        return index_map
+
+    def _rebuild_from_files(self, index_map: mmap.mmap) -> None:
+        """索引重建时扫描目录，以文件修改时间作为最近访问时间"""
+        count = 0
+        for entry in self._scan_objects():
+            name_match = _NAME_PATTERN.match(entry.name)
+            if name_match is None or name_match.group(2) not in _EXTENSIONS:
+                continue
+            stat = entry.stat()
+            key = bytes.fromhex(name_match.group(1))
+            self._insert(index_map, key, _EXTENSIONS.index(name_match.group(2)), stat.st_size, int(stat.st_mtime))
+            count += 1
+        if count:
+            log.info(f"磁盘渲染缓存索引已重建: {count}个文件")
+
+    def _scan_objects(self):
+        for shard in os.scandir(self.objects_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and not entry.name.endswith(".tmp"):
+                        yield entry
+
+    # ---- 哈希表操作，调用方持有锁 ----
+
+    def _header(self, index_map: mmap.mmap) -> List[int]:
+        return list(_HEADER.unpack_from(index_map, 0)[3:])
+
+    def _set_header(self, index_map: mmap.mmap, entries: int, total_bytes: int, tombstones: int) -> None:
+        _HEADER.pack_into(index_map, 0, _MAGIC, self.capacity, 0, entries, total_bytes, tombstones)
+
+    def _slot_offset(self, slot: int) -> int:
+        return _HEADER_SIZE + slot * _SLOT.size
+
+    def _find(self, index_map: mmap.mmap, key: bytes) -> Tuple[int, int]:
+        """返回（键所在槽位或-1，可插入的槽位）"""
+        mask = self.capacity - 1
+        slot = int.from_bytes(key[:8], "little") & mask
+        free = -1
+        for _ in range(self.capacity):
+            offset = self._slot_offset(slot)
+            state = index_map[offset]
+            if state == _EMPTY:
+                return -1, slot if free < 0 else free
+            if state == _DELETED:
+                if free < 0:
+                    free = slot
+            elif index_map[offset + 12:offset + 44] == key:
+                return slot, slot
+            slot = (slot + 1) & mask
+        return -1, free
+
+    def _insert(self, index_map: mmap.mmap, key: bytes, ext: int, size: int, atime: int) -> None:
+        entries, total_bytes, tombstones = self._header(index_map)
+        found, slot = self._find(index_map, key)
+        if found >= 0:
+            old_size = _SLOT.unpack_from(index_map, self._slot_offset(found))[2]
+            total_bytes -= old_size
+        else:
+            if index_map[self._slot_offset(slot)] == _DELETED:
+                tombstones -= 1
+            entries += 1
+        _SLOT.pack_into(index_map, self._slot_offset(slot), _USED, ext, size, atime, key)
+        self._set_header(index_map, entries, total_bytes + size, tombstones)
+
+    def _remove_slot(self, index_map: mmap.mmap, slot: int) -> None:
+        entries, total_bytes, tombstones = self._header(index_map)
+        size = _SLOT.unpack_from(index_map, self._slot_offset(slot))[2]
+        index_map[self._slot_offset(slot)] = _DELETED
+        self._set_header(index_map, entries - 1, total_bytes - size, tombstones + 1)
+
+    def _live_slots(self, index_map: mmap.mmap) -> List[Tuple[int, int, int, int, bytes]]:
+        """所有有效槽位：（最近访问时间，槽位，扩展名编号，大小，缓存键）"""
+        slots = []
+        region = memoryview(index_map)[_HEADER_SIZE:_HEADER_SIZE + self.capacity * _SLOT.size]
+        try:
+            for slot, (state, ext, size, atime, key) in enumerate(_SLOT.iter_unpack(region)):
+                if state == _USED:
+                    slots.append((atime, slot, ext, size, key))
+        finally:
+            region.release()
+        return slots
+
+    def _compact(self, index_map: mmap.mmap) -> None:
+        """删除标记过多时重新插入所有有效条目"""
+        live = self._live_slots(index_map)
+        index_map[_HEADER_SIZE:] = bytes(self.capacity * _SLOT.size)
+        self._set_header(index_map, 0, 0, 0)
+        for atime, _, ext, size, key in live:
+            self._insert(index_map, key, ext, size, atime)
+
+    def _evict(self, index_map: mmap.mmap, keep: bytes) -> List[str]:
+        """按最近访问时间淘汰到上限的90%，不淘汰刚写入的keep，返回需要删除的文件"""
+        entries, total_bytes, _ = self._header(index_map)
+        if total_bytes <= self.max_bytes and entries <= self.max_entries:
+            return []
+        target_bytes = self.max_bytes * 9 // 10
+        target_entries = self.max_entries * 9 // 10
+        paths = []
+        for atime, slot, ext, size, key in sorted(self._live_slots(index_map)):
+            if total_bytes <= target_bytes and entries <= target_entries:
+                break
+            if key == keep:
+                continue
+            self._remove_slot(index_map, slot)
+            paths.append(self._path(key.hex(), _EXTENSIONS[ext]))
+            total_bytes -= size
+            entries -= 1
+            self.evictions += 1
+        return paths
+
+    # ---- 公开接口 ----
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.objects_dir, key[:2], f"{key}.{extension}")
+
+    @staticmethod
+    def filename(key: str, extension: str) -> str:
+        """缓存文件对外使用的文件名"""
+        return f"{key}.{extension}"
+
+    def lookup(self, key: str) -> Optional[str]:
+        """查找缓存键对应的文件并更新最近访问时间，不存在时返回None"""
+        raw_key = bytes.fromhex(key)
+        with self._locked(exclusive=False):
+            slot, _ = self._find(self._map, raw_key)
+            if slot < 0:
+                return None
+            offset = self._slot_offset(slot)
+            ext = self._map[offset + 1]
+            # 访问时间只影响淘汰顺序，并发写入同一个值无需独占锁
+            struct.pack_into("<I", self._map, offset + 8, int(time.time()))
+        return self._path(key, _EXTENSIONS[ext])
+
+    def __contains__(self, key: str) -> bool:
+        with self._locked(exclusive=False):
+            return self._find(self._map, bytes.fromhex(key))[0] >= 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存的图片，文件已被其他进程淘汰时视为未命中"""
+        path = self.lookup(key)
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                self.hits += 1
+                return data
+            except FileNotFoundError:
+                self._discard(key)
+        self.misses += 1
+        return None
+
+    def open_file(self, name: str) -> Optional[str]:
+        """按对外的文件名查找缓存文件路径，用于直接提供图片访问"""
+        match = _NAME_PATTERN.match(name)
+        if match is None or match.group(2) not in _EXTENSIONS:
+            return None
+        path = self.lookup(match.group(1))
+        if path is None or not path.endswith(name) or not os.path.exists(path):
+            return None
+        return path
+
+    def put(self, key: str, data: bytes, extension: str) -> Optional[str]:
+        """写入缓存并返回文件名；相同的键只保存一份，超过容量上限的图片不缓存"""
+        if len(data) > self.max_bytes:
+            return None
+        name = self.filename(key, extension)
+        path = self._path(key, extension)
+        raw_key = bytes.fromhex(key)
+        # 在锁外写好临时文件，锁内只做替换，避免与其他进程的淘汰交错后索引指向已删除的文件
+        tmp_path = None
+        if not os.path.exists(path):
+            tmp_path = self._write_tmp(path, data)
+
+        with self._locked(exclusive=True):
+            if not os.path.exists(path):
+                os.replace(tmp_path or self._write_tmp(path, data), path)
+                tmp_path = None
+            self._insert(self._map, raw_key, _EXTENSIONS.index(extension), len(data), int(time.time()))
+            for evicted_path in self._evict(self._map, raw_key):
+                try:
+                    os.remove(evicted_path)
+                except FileNotFoundError:
+                    pass
+            if self._header(self._map)[2] > self.capacity // 4:
+                self._compact(self._map)
+        if tmp_path is not None:
+            os.remove(tmp_path)
+        return name
+
+    @staticmethod
+    def _write_tmp(path: str, data: bytes) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return tmp_path
+
+    def _discard(self, key: str) -> None:
+        with self._locked(exclusive=True):
+            slot, _ = self._find(self._map, bytes.fromhex(key))
+            if slot >= 0:
+                self._remove_slot(self._map, slot)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._locked(exclusive=False):
+            entries, total_bytes, _ = self._header(self._map)
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions
+        }
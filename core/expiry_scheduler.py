@@ -0,0 +1,139 @@
+import os
+import time
+import heapq
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from core.core import log
+
+
+class ExpiryScheduler:
+    """临时文件过期删除调度器
+
+    用一个最小堆保存所有文件的过期时间，由单个后台线程在最早的过期时间醒来并批量删除，
+    启动时根据目录中已有文件的修改时间重建删除计划，重启后不会遗留文件。
+    """
+
+    def __init__(self, directory: str, retention_seconds: float = 300, batch_size: int = 256):
+        self.directory = directory
+        # 文件保留时间，为0时禁用自动删除
+        self.retention_seconds = retention_seconds
+        self.batch_size = batch_size
+        self._heap: List[Tuple[float, str]] = []
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self.deleted = 0
+        # fork时后台线程可能正持有锁，子进程中重新创建锁
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.retention_seconds > 0
+
+    def start(self) -> None:
+        """扫描目录重建删除计划并启动后台线程"""
+        self._rebuild()
+        self._ensure_thread()
+
+    def _rebuild(self) -> None:
+        """根据已有文件的修改时间重建删除计划"""
+        if not os.path.isdir(self.directory):
+            return
+        count = 0
+        with self._cond:
+            for entry in os.scandir(self.directory):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                self._track(entry.path, stat.st_size, stat.st_mtime + self.retention_seconds)
+                count += 1
+            self._cond.notify()
+        if count:
+            log.info(f"已恢复{count}个临时图片的删除计划")
+
+    def _ensure_thread(self) -> None:
+        # fork出的子进程不会继承后台线程，需要重新启动
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="expiry-scheduler", daemon=True)
+        self._thread.start()
+
+    def _track(self, path: str, size: int, expires_at: float) -> None:
+        """登记文件，调用方需持有锁"""
+        self._bytes += size - self._sizes.get(path, 0)
+        self._sizes[path] = size
+        if self.enabled:
+            heapq.heappush(self._heap, (expires_at, path))
+
+    def schedule(self, path: str, size: Optional[int] = None) -> None:
+        """登记新文件，在保留时间后删除"""
+        if size is None:
+            size = os.path.getsize(path)
+        with self._cond:
+            was_empty = not self._heap
+            self._track(path, size, time.time() + self.retention_seconds)
+            # 新文件的过期时间不会早于已有文件，只有堆为空时才需要唤醒线程
+            if was_empty:
+                self._cond.notify()
+        self._ensure_thread()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if self._stopped:
+                    return
+                # 一次取出一批已过期的文件，在锁外删除
+                now = time.time()
+                batch = []
+                while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                    _, path = heapq.heappop(self._heap)
+                    batch.append(path)
+            self._delete_batch(batch)
+
+    def _delete_batch(self, batch: List[str]) -> None:
+        deleted = 0
+        for path in batch:
+            try:
+                os.remove(path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                log.error(f"删除临时图片失败: {e}")
+        with self._cond:
+            for path in batch:
+                self._bytes -= self._sizes.pop(path, 0)
+            self.deleted += deleted
+        if deleted:
+            log.info(f"已删除{deleted}个过期临时图片")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回队列长度和磁盘占用"""
+        with self._cond:
+            return {
+                "queued": len(self._heap),
+                "bytes_on_disk": self._bytes,
+                "deleted": self.deleted
+            }
+
+    def stop(self) -> None:
+        """停止后台线程"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
@@ -0,0 +1,270 @@
+import os
+import mmap
+import time
+import hashlib
+import mimetypes
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+from core.core import log
+from core.expiry_scheduler import ExpiryScheduler
+
+
+class StoredImage:
+    """已存储的图片及其响应头所需信息，mmap后端的data是指向段文件的memoryview"""
+    __slots__ = ("data", "etag", "media_type", "created_at")
+
+    def __init__(self, data: Union[bytes, memoryview], etag: str, media_type: str, created_at: float):
+        self.data = data
+        self.etag = etag
+        self.media_type = media_type
+        self.created_at = created_at
+
+
+def _make_etag(data: bytes) -> str:
+    return '"' + hashlib.blake2b(data, digest_size=16).hexdigest() + '"'
+
+
+def _media_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+class ImageStore(ABC):
+    """生成图片的存储后端基类"""
+    backend = ""
+
+    def __init__(self, retention_seconds: float = 300):
+        # 图片保留时间，为0时不过期
+        self.retention_seconds = retention_seconds
+
+    @abstractmethod
+    def put(self, name: str, data: bytes) -> None:
+        """保存图片"""
+
+    @abstractmethod
+    def get(self, name: str) -> Optional[StoredImage]:
+        """读取图片，不存在或已过期时返回None"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """存储后端的统计信息"""
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.retention_seconds > 0 and created_at + self.retention_seconds < now
+
+
+class DiskImageStore(ImageStore):
+    """写入图片目录，由StaticFiles提供访问，过期文件由调度器删除"""
+    backend = "disk"
+
+    def __init__(self, directory: str, retention_seconds: float = 300):
+        super().__init__(retention_seconds)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # 启动时恢复目录中已有文件的删除计划
+        self.expiry_scheduler = ExpiryScheduler(directory, retention_seconds=retention_seconds)
+        self.expiry_scheduler.start()
+
+    def put(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.expiry_scheduler.schedule(path, len(data))
+
+    def get(self, name: str) -> Optional[StoredImage]:
+        path = os.path.join(self.directory, os.path.basename(name))
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            created_at = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        return StoredImage(data, _make_etag(data), _media_type(name), created_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, **self.expiry_scheduler.stats()}
+
+
+class MemoryImageStore(ImageStore):
+    """内存存储，总字节数超过上限时淘汰最早写入的图片"""
+    backend = "memory"
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, retention_seconds: float = 300):
+        super().__init__(retention_seconds)
+        self.max_bytes = max_bytes
+        self._images: "OrderedDict[str, StoredImage]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def put(self, name: str, data: bytes) -> None:
+        image = StoredImage(data, _make_etag(data), _media_type(name), time.time())
+        with self._lock:
+            old = self._images.pop(name, None)
+            if old is not None:
+                self._bytes -= len(old.data)
+            self._images[name] = image
+            self._bytes += len(data)
+            # 按写入顺序淘汰：先清理过期图片，再按容量淘汰
+            while self._images:
+                oldest_name, oldest = next(iter(self._images.items()))
+                if not (self._bytes > self.max_bytes or self._expired(oldest.created_at, image.created_at)):
+                    break
+                del self._images[oldest_name]
+                self._bytes -= len(oldest.data)
+                self.evictions += 1
+
+    def get(self, name: str) -> Optional[StoredImage]:
+        with self._lock:
+            image = self._images.get(name)
+        if image is None or self._expired(image.created_at, time.time()):
+            return None
+        return image
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "entries": len(self._images),
+                "bytes": self._bytes,
+                "evictions": self.evictions
+            }
+
+
+class _Segment:
+    """预分配大小并映射到内存的段文件"""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.offset = 0
+        self.names: List[str] = []
+        self.last_created_at = 0.0
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self._fd, size)
+        self.map = mmap.mmap(self._fd, size)
+
+    def append(self, data: bytes) -> int:
+        offset = self.offset
+        self.map[offset:offset + len(data)] = data
+        self.offset += len(data)
+        return offset
+
+    def close(self) -> None:
+        os.close(self._fd)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        try:
+            self.map.close()
+        except BufferError:
+            # 仍有响应在读取该段，映射在最后一个memoryview释放后随对象回收关闭
+            pass
+
+
+class SegmentImageStore(ImageStore):
+    """段文件存储，图片追加写入预分配的段文件，通过mmap读取
+
+    读取时不需要open/stat系统调用，段文件整体过期或超出容量时整段删除。
+    """
+    backend = "mmap"
+
+    def __init__(self, directory: str, segment_size: int = 16 * 1024 * 1024,
+                 max_bytes: int = 256 * 1024 * 1024, retention_seconds: float = 300):
+        super().__init__(retention_seconds)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self._segments: "OrderedDict[int, _Segment]" = OrderedDict()
+        # 文件名 -> (段编号, 偏移, 长度, ETag, 写入时间)
+        self._index: Dict[str, Tuple[int, int, int, str, float]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        # 段文件只保存临时图片，启动时清理上次运行遗留的文件
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(".seg"):
+                os.unlink(entry.path)
+
+    def _new_segment(self, size: int) -> Tuple[int, _Segment]:
+        segment_id = self._next_id
+        self._next_id += 1
+        path = os.path.join(self.directory, f"{segment_id:08d}.seg")
+        segment = _Segment(path, max(size, self.segment_size))
+        self._segments[segment_id] = segment
+        return segment_id, segment
+
+    def _drop_oldest(self) -> None:
+        segment_id, segment = self._segments.popitem(last=False)
+        for name in segment.names:
+            entry = self._index.get(name)
+            if entry is not None and entry[0] == segment_id:
+                del self._index[name]
+                self.evictions += 1
+        segment.close()
+
+    def _mapped_bytes(self) -> int:
+        return sum(segment.size for segment in self._segments.values())
+
+    def put(self, name: str, data: bytes) -> None:
+        now = time.time()
+        etag = _make_etag(data)
+        with self._lock:
+            # 最早的段中所有图片都已过期或超出容量时整段删除
+            while len(self._segments) > 1:
+                oldest = next(iter(self._segments.values()))
+                if not (self._expired(oldest.last_created_at, now) or self._mapped_bytes() > self.max_bytes):
+                    break
+                self._drop_oldest()
+
+            if self._segments:
+                segment_id = next(reversed(self._segments))
+                segment = self._segments[segment_id]
+                if segment.offset + len(data) > segment.size:
+                    segment_id, segment = self._new_segment(len(data))
+            else:
+                segment_id, segment = self._new_segment(len(data))
+
+            offset = segment.append(data)
+            segment.names.append(name)
+            segment.last_created_at = now
+            self._index[name] = (segment_id, offset, len(data), etag, now)
+
+    def get(self, name: str) -> Optional[StoredImage]:
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is None:
+                return None
+            segment_id, offset, length, etag, created_at = entry
+            if self._expired(created_at, time.time()):
+                return None
+            # 不复制图片数据，memoryview引用映射使段文件在响应发送完之前保持映射
+            data = memoryview(self._segments[segment_id].map)[offset:offset + length]
+        return StoredImage(data, etag, _media_type(name), created_at)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "entries": len(self._index),
+                "segments": len(self._segments),
+                "mapped_bytes": self._mapped_bytes(),
+                "evictions": self.evictions
+            }
+
+
+def create_image_store(backend: str, directory: str, segment_directory: str,
+                       retention_seconds: float, max_bytes: int, segment_size: int) -> ImageStore:
+    """根据配置创建图片存储后端"""
+    if backend == "disk":
+        return DiskImageStore(directory, retention_seconds=retention_seconds)
+    if backend == "memory":
+        return MemoryImageStore(max_bytes=max_bytes, retention_seconds=retention_seconds)
+    if backend == "mmap":
+        return SegmentImageStore(segment_directory, segment_size=segment_size,
+                                 max_bytes=max_bytes, retention_seconds=retention_seconds)
+    log.error(f"不支持的图片存储后端: {backend}，使用disk")
+    return DiskImageStore(directory, retention_seconds=retention_seconds)
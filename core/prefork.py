@@ -0,0 +1,139 @@
+import gc
+import os
+import time
+import signal
+from typing import Any, Dict, Optional
+import uvicorn
+from core.core import log
+
+# 当前进程在多进程模式中的编号，单进程模式和主进程中为None
+worker_index: Optional[int] = None
+# 导入应用并预加载字体、底图的耗时，单位为秒
+preload_seconds: Optional[float] = None
+
+# smaps_rollup中的字段 -> 返回的键，共享页包括未修改和已修改的共享页
+MEMORY_FIELDS = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared"}
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, int]:
+    """读取进程的内存占用（字节），PSS按共享进程数分摊共享页，只支持Linux"""
+    usage: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                key = MEMORY_FIELDS.get(name)
+                if key is not None:
+                    usage[key] = usage.get(key, 0) + int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return {}
+    return usage
+
+
+def process_stats() -> Dict[str, Any]:
+    """当前进程的编号、预加载耗时和内存占用"""
+    return {
+        "pid": os.getpid(),
+        "worker": worker_index,
+        "preload_seconds": preload_seconds,
+        **process_memory()
+    }
+
+
+def format_memory(usage: Dict[str, int]) -> str:
+    if not usage:
+        return "内存占用未知"
+    return "，".join(f"{name.upper()} {usage.get(name, 0) / 1024 / 1024:.1f}MiB" for name in ("rss", "pss", "shared"))
+
+
+class PreforkServer:
+    """预派生多进程服务器
+
+    主进程导入应用、预加载字体和底图后绑定监听端口，再fork出多个工作进程共享该端口，
+    预加载的数据以写时复制的方式在进程间共享。工作进程异常退出时重新派生，
+    启动后等待report_delay秒报告各进程的内存占用。
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int, log_level: str = "info", report_delay: float = 5.0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.log_level = log_level
+        self.report_delay = report_delay
+        self._children: Dict[int, int] = {}  # pid -> 工作进程编号
+        self._stopping = False
+        self._socket = None
+
+    def run(self) -> None:
+        self._socket = uvicorn.Config(self.app, host=self.host, port=self.port).bind_socket()
+        # 冻结预加载的对象，垃圾回收不再遍历和修改这些对象，避免共享页被复制
+        gc.freeze()
+        for index in range(self.workers):
+            self._spawn(index)
+        log.info(f"已启动{self.workers}个工作进程")
+
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        report_at = time.monotonic() + self.report_delay
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                if report_at is not None and time.monotonic() >= report_at:
+                    report_at = None
+                    self.report()
+                time.sleep(0.5)
+                continue
+            index = self._children.pop(pid, None)
+            if index is None or self._stopping:
+                continue
+            log.warning(f"工作进程{index}（pid {pid}）异常退出，退出码{os.waitstatus_to_exitcode(status)}，1秒后重新启动")
+            time.sleep(1)
+            if not self._stopping:
+                self._spawn(index)
+        self._socket.close()
+        log.info("所有工作进程已退出")
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid:
+            self._children[pid] = index
+            return
+        code = 0
+        try:
+            self._serve(index)
+        except BaseException as e:
+            log.error(f"工作进程{index}异常退出: {e}")
+            code = 1
+        finally:
+            # os._exit不会执行atexit，先写出队列中的日志
+            log.stop()
+            os._exit(code)
+
+    def _serve(self, index: int) -> None:
+        global worker_index
+        worker_index = index
+        # 恢复默认信号处理，由uvicorn在工作进程中重新安装
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        log.info(f"工作进程{index}已启动（pid {os.getpid()}），{format_memory(process_memory())}")
+        server = uvicorn.Server(uvicorn.Config(self.app, log_level=self.log_level))
+        server.run(sockets=[self._socket])
+
+    def _handle_exit(self, signum, frame) -> None:
+        """转发为SIGTERM，工作进程处理完进行中的请求后退出"""
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report(self) -> None:
+        """报告主进程和各工作进程的内存占用"""
+        log.info(f"主进程（pid {os.getpid()}）: {format_memory(process_memory())}")
+        for pid, index in sorted(self._children.items(), key=lambda item: item[1]):
+            log.info(f"工作进程{index}（pid {pid}）: {format_memory(process_memory(pid))}")
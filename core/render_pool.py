@@ -0,0 +1,187 @@
+import os
+import time
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+from core.core import log
+
+
+class RenderPoolFull(Exception):
+    """渲染队列已满，请求应被快速拒绝"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("渲染队列已满")
+        self.retry_after = retry_after
+
+
+def _ping() -> int:
+    """健康检查任务，返回工作进程PID"""
+    return os.getpid()
+
+
+class RenderPool:
+    """有界渲染工作池
+
+    CPU密集的渲染任务在线程池或进程池中执行，避免阻塞事件循环。
+    同时执行的任务数受max_in_flight限制，排队任务超过queue_size时直接拒绝。
+
+    进程池模式下每个工作进程通过initializer预热自己的渲染状态，
+    执行max_jobs_per_worker个任务后自动替换，进程崩溃时重建整个进程池。
+    提交给进程池的函数和参数必须可以被pickle。
+    """
+
+    def __init__(self,
+                 workers: int = 0,
+                 queue_size: int = 64,
+                 max_in_flight: int = 0,
+                 retry_after: int = 1,
+                 backend: str = "thread",
+                 initializer: Optional[Callable[[], None]] = None,
+                 max_jobs_per_worker: int = 0,
+                 start_method: str = "spawn",
+                 health_check_interval: float = 30
+                ):
+        if backend not in ("thread", "process"):
+            raise ValueError(f"不支持的渲染后端: {backend}")
+        # 工作线程/进程数，为0时使用CPU核心数
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.queue_size = max(queue_size, 0)
+        self.max_in_flight = max_in_flight if max_in_flight > 0 else self.workers
+        self.retry_after = retry_after
+        self.backend = backend
+        self.initializer = initializer
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.start_method = start_method
+        self.health_check_interval = health_check_interval
+        # 执行器延迟创建，避免在子进程导入模块时启动进程池
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._health_task: Optional[asyncio.Task] = None
+        # 以下计数只在事件循环线程中修改
+        self._pending = 0
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.last_health_check: Optional[float] = None
+        self.healthy = True
+
+    def _create_executor(self) -> Executor:
+        if self.backend == "thread":
+            return ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="render",
+                initializer=self.initializer
+            )
+        # fork模式不支持按任务数替换进程
+        if self.start_method == "fork":
+            raise ValueError("进程池渲染后端不支持fork启动方式，请使用spawn或forkserver")
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=self.initializer,
+            max_tasks_per_child=self.max_jobs_per_worker or None
+        )
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._create_executor()
+        return self._executor
+
+    def _restart(self, reason: str) -> None:
+        """重建执行器，已损坏的进程池无法继续使用"""
+        log.warning(f"重建渲染{self.backend}池: {reason}")
+        old, self._executor = self._executor, None
+        if old is not None:
+            old.shutdown(wait=False, cancel_futures=True)
+        self.restarts += 1
+
+    async def _submit(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+        except BrokenProcessPool:
+            # 只重建一次，其他同时失败的请求会看到新的执行器
+            if self._executor is executor:
+                self._restart("工作进程异常退出")
+            raise
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """在工作池中执行任务，队列已满时抛出RenderPoolFull"""
+        if self._pending >= self.max_in_flight + self.queue_size:
+            self.rejected += 1
+            raise RenderPoolFull(self.retry_after)
+        # 信号量和健康检查任务绑定在当前事件循环上
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._health_task = None
+        self._ensure_health_task()
+
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                self._in_flight += 1
+                try:
+                    result = await self._submit(func, *args, **kwargs)
+                finally:
+                    self._in_flight -= 1
+            self.completed += 1
+            return result
+        finally:
+            self._pending -= 1
+
+    async def health_check(self, timeout: float = 10) -> bool:
+        """向工作池提交探测任务，超时或失败时重建工作池"""
+        self.last_health_check = time.time()
+        try:
+            await asyncio.wait_for(self._submit(_ping), timeout=timeout)
+            self.healthy = True
+        except Exception as e:
+            self.healthy = False
+            if self._executor is not None:
+                self._restart(f"健康检查失败: {e!r}")
+        return self.healthy
+
+    def _ensure_health_task(self) -> None:
+        """首次提交任务时在当前事件循环中启动定期健康检查"""
+        if self.backend != "process" or self.health_check_interval <= 0:
+            return
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            # 所有槽位都在执行任务时跳过，避免探测任务排队误判
+            if self._in_flight < self.max_in_flight:
+                await self.health_check()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回工作池统计"""
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "max_in_flight": self.max_in_flight,
+            "queue_size": self.queue_size,
+            "in_flight": self._in_flight,
+            "queued": self._pending - self._in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            "healthy": self.healthy
+        }
+
+    def shutdown(self) -> None:
+        """关闭工作池"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+from PIL import Image, ImageSequence
+
+# 帧没有时长信息时使用的默认值（毫秒）
+DEFAULT_FRAME_DURATION = 100
+
+
+@dataclass(frozen=True)
+class RawImage:
+    """未压缩的图像数据，可以低成本地在工作进程之间传递"""
+    mode: str
+    size: Tuple[int, int]
+    data: bytes
+
+    @classmethod
+    def from_image(cls, image: Image.Image) -> "RawImage":
+        return cls(image.mode, image.size, image.tobytes())
+
+    def to_image(self) -> Image.Image:
+        return Image.frombytes(self.mode, self.size, self.data)
+
+
+def is_animated(image: Image.Image) -> bool:
+    """只解析文件头判断是否为多帧动图"""
+    return bool(getattr(image, "is_animated", False))
+
+
+def decode_frames(image: Image.Image,
+                  max_frames: int,
+                  max_duration: int = 0,
+                  max_pixels: int = 0,
+                  fit: Optional[Callable[[Image.Image], Image.Image]] = None
+                 ) -> Tuple[List[Image.Image], List[int]]:
+    """按顺序解码动图的各帧，返回（帧列表，每帧时长）
+
+    每帧解码后立即由fit缩小，只保留缩小后的帧。相邻的相同帧合并为一帧并累加时长。
+    解码的帧数不超过max_frames，累计时长不超过max_duration毫秒（第一帧除外），
+    解码像素总数超过max_pixels后停止，超出部分直接截断，保证单个请求的开销有上限。
+    """
+    width, height = image.size
+    if max_pixels > 0:
+        max_frames = max(1, min(max_frames, max_pixels // max(width * height, 1)))
+
+    frames: List[Image.Image] = []
+    durations: List[int] = []
+    previous = None
+    total = 0
+    for index, frame in enumerate(ImageSequence.Iterator(image)):
+        if index >= max_frames:
+            break
+        duration = frame.info.get("duration") or DEFAULT_FRAME_DURATION
+        if frames and max_duration > 0 and total + duration > max_duration:
+            break
+        current = frame.convert("RGBA")
+        if fit is not None:
+            current = fit(current)
+        total += duration
+        data = current.tobytes()
+        if data == previous:
+            durations[-1] += duration
+            continue
+        previous = data
+        frames.append(current)
+        durations.append(duration)
+    return frames, durations
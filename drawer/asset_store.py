@@ -0,0 +1,122 @@
+import os
+import time
+import threading
+from typing import Dict, Iterable, Optional, Any
+from PIL import Image
+from core.core import log
+
+
+class _Asset:
+    """单个已解码资源及其文件状态"""
+    __slots__ = ("image", "mtime", "checked_at")
+
+    def __init__(self, image: Image.Image, mtime: float, checked_at: float):
+        self.image = image
+        self.mtime = mtime
+        self.checked_at = checked_at
+
+
+class AssetStore:
+    """底图与衣袖遮挡层的解码缓存
+
+    所有资源在启动时解码为只读的RGBA图像，由所有请求共享，
+    文件修改时间变化后会自动重新解码。
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        # 两次检查文件修改时间的最小间隔（秒），为0时每次访问都检查
+        self.check_interval = check_interval
+        self._assets: Dict[str, _Asset] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    @staticmethod
+    def _decode(path: str) -> Image.Image:
+        """解码图片为只读RGBA图像"""
+        with Image.open(path) as src:
+            image = src.convert("RGBA")
+        image.readonly = 1
+        return image
+
+    def _load(self, path: str) -> _Asset:
+        """读取文件并解码，不修改缓存，可在锁外调用"""
+        mtime = os.stat(path).st_mtime
+        return _Asset(self._decode(path), mtime, time.monotonic())
+
+    def preload(self, paths: Iterable[str]) -> None:
+        """启动时预先解码资源，缺失的文件只记录警告"""
+        with self._lock:
+            for path in paths:
+                if path in self._assets:
+                    continue
+                try:
+                    self._assets[path] = self._load(path)
+                except FileNotFoundError:
+                    log.warning(f"底图资源不存在，跳过预加载: {path}")
+                except Exception as e:
+                    log.error(f"预加载底图资源失败: {path}, {e}")
+
+    def get(self, path: str) -> Image.Image:
+        """获取共享的只读图像，调用方不得修改
+
+        未命中或文件已更新时在锁外解码，完成后再替换，解码期间不阻塞其他资源的访问。
+        """
+        with self._lock:
+            asset = self._assets.get(path)
+            now = time.monotonic()
+            if asset is not None:
+                if now - asset.checked_at < self.check_interval:
+                    self.hits += 1
+                    return asset.image
+                # 由本次访问检查修改时间，检查期间其他访问继续使用当前版本
+                asset.checked_at = now
+
+        if asset is not None:
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                # 文件被删除时继续使用已解码的版本
+                mtime = asset.mtime
+            if mtime == asset.mtime:
+                with self._lock:
+                    self.hits += 1
+                return asset.image
+            log.info(f"底图资源已更新，重新加载: {path}")
+
+        loaded = self._load(path)
+        with self._lock:
+            if asset is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            current = self._assets.get(path)
+            # 其他访问已经解码了同一版本时沿用，所有调用方共享同一个图像
+            if current is not None and current is not asset and current.mtime == loaded.mtime:
+                return current.image
+            self._assets[path] = loaded
+            return loaded.image
+
+    def get_optional(self, path: str) -> Optional[Image.Image]:
+        """获取共享图像，文件不存在时返回None"""
+        try:
+            return self.get(path)
+        except FileNotFoundError:
+            return None
+
+    def evict(self, paths: Iterable[str]) -> None:
+        """释放不再常驻的资源，下次访问时重新解码"""
+        with self._lock:
+            for path in paths:
+                self._assets.pop(path, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存命中统计"""
+        with self._lock:
+            return {
+                "entries": len(self._assets),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads
+            }
@@ -0,0 +1,124 @@
+import threading
+from typing import Dict, Iterable, Optional, Tuple, Any
+from PIL import Image
+
+Rect = Tuple[int, int, int, int]
+
+
+def union_rect(a: Rect, b: Rect) -> Rect:
+    """两个矩形的外接矩形"""
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _paste_overlay(img: Image.Image, overlay: Image.Image) -> None:
+    img.paste(overlay, (0, 0), overlay if overlay.mode == 'RGBA' else None)
+
+
+class StaticFrame:
+    """底图与衣袖遮挡层合成后的静态画面
+
+    文字和图片只会画在素描本区域内，区域外的像素对同一表情的所有请求都相同，
+    因此预先合成一次；区域内的底图和遮挡层也预先裁剪好，请求只处理这一小块。
+    """
+
+    def __init__(self, base: Image.Image, overlay: Optional[Image.Image], box: Rect, shared: bool = False):
+        self.base = base
+        self.overlay = overlay
+        self.box = box
+        # 是否被缓存并在多次请求间复用
+        self.shared = shared
+        image = base.copy()
+        if overlay is not None:
+            _paste_overlay(image, overlay)
+        image.readonly = 1
+        self.image = image
+        self.size = image.size
+        self._box_crops = self._crop(box)
+
+    def _crop(self, rect: Rect) -> Tuple[Image.Image, Optional[Image.Image]]:
+        base_crop = self.base.crop(rect)
+        overlay_crop = self.overlay.crop(rect) if self.overlay is not None else None
+        return base_crop, overlay_crop
+
+    def crops(self, rect: Rect) -> Tuple[Image.Image, Optional[Image.Image]]:
+        """返回矩形内的（底图，遮挡层）裁剪，素描本区域使用预先裁剪的结果"""
+        if rect == self.box:
+            return self._box_crops
+        return self._crop(rect)
+
+    def clip(self, rect: Rect) -> Rect:
+        """将矩形裁剪到画面范围内"""
+        width, height = self.size
+        return (max(rect[0], 0), max(rect[1], 0), min(rect[2], width), min(rect[3], height))
+
+
+class DirtyRegion:
+    """单次渲染需要重绘的矩形区域
+
+    调用方在tile上绘制，坐标需减去offset；compose时叠加遮挡层并写回静态画面。
+    绘制坐标减去offset后应保持非负，这样小数坐标的取整方式与在整张画布上绘制一致，
+    输出与直接在整张图上绘制逐像素相同。
+    """
+
+    def __init__(self, frame: StaticFrame, rect: Rect):
+        self.frame = frame
+        self.rect = rect
+        base_crop, self._overlay_crop = frame.crops(rect)
+        self.tile = base_crop.copy()
+
+    @property
+    def offset(self) -> Tuple[int, int]:
+        return self.rect[0], self.rect[1]
+
+    def finish_tile(self) -> Image.Image:
+        """在重绘区域上叠加遮挡层，返回最终的区域图像"""
+        if self._overlay_crop is not None:
+            _paste_overlay(self.tile, self._overlay_crop)
+            self._overlay_crop = None
+        return self.tile
+
+    def compose(self) -> Image.Image:
+        """返回完整画面：静态画面的副本写入重绘区域"""
+        tile = self.finish_tile()
+        image = self.frame.image.copy()
+        image.paste(tile, self.offset)
+        return image
+
+
+class Compositor:
+    """按（底图，遮挡层）缓存静态画面，并为每次渲染分配重绘区域"""
+
+    def __init__(self, box: Rect):
+        self.box = box
+        self._frames: Dict[Tuple[str, Optional[str]], StaticFrame] = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def frame(self, base: Image.Image, overlay: Optional[Image.Image],
+              key: Optional[Tuple[str, Optional[str]]] = None) -> StaticFrame:
+        """获取静态画面，key为None时不缓存；底图或遮挡层被重新加载后自动重建"""
+        if key is None:
+            return StaticFrame(base, overlay, self.box)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None or frame.base is not base or frame.overlay is not overlay:
+                frame = StaticFrame(base, overlay, self.box, shared=True)
+                self._frames[key] = frame
+                self.builds += 1
+            return frame
+
+    def evict(self, paths: Iterable[str]) -> None:
+        """丢弃使用这些底图的静态画面"""
+        paths = set(paths)
+        with self._lock:
+            for key in [key for key in self._frames if key[0] in paths]:
+                del self._frames[key]
+
+    def region(self, frame: StaticFrame, rect: Optional[Rect] = None) -> DirtyRegion:
+        """分配重绘区域，rect至少覆盖素描本区域"""
+        rect = self.box if rect is None else frame.clip(union_rect(self.box, rect))
+        return DirtyRegion(frame, rect)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"frames": len(self._frames), "builds": self.builds}
@@ -0,0 +1,244 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import toml
+from PIL import Image
+from core.core import log
+from drawer.emotion_tags import EmotionTagParser
+
+# 根目录下的图片属于默认表情包，始终常驻
+ROOT_PACK = ""
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+@dataclass(frozen=True)
+class EmotionTable:
+    """某一时刻的表情映射快照，配置或目录变化时整体替换，读取时无需加锁"""
+    mapping: Dict[str, str]  # 表情标签 -> 底图文件
+    packs: Dict[str, Tuple[str, ...]]  # 表情包 -> 底图文件
+    pack_of: Dict[str, str]  # 底图文件 -> 表情包
+    parser: EmotionTagParser
+
+
+class EmotionRegistry:
+    """表情差分注册表
+
+    表情来自配置中的emotion_mapping，以及图片目录中自动发现的文件：根目录的图片
+    注册为#文件名#，子目录作为表情包注册为#表情包/文件名#。配置文件和目录的修改时间
+    变化后重新扫描，无需重启。子目录表情包在首次使用时才解码，常驻的表情包超过内存
+    预算时淘汰最久未使用的表情包，由on_evict释放其底图和静态画面。
+    """
+
+    def __init__(self,
+                 images_dir: str,
+                 mapping: Dict[str, str],
+                 config_file: Optional[str] = None,
+                 reserved: Iterable[str] = (),
+                 auto_discover: bool = True,
+                 check_interval: float = 2.0,
+                 memory_budget: int = 0,
+                 on_evict: Optional[Callable[[List[str]], None]] = None):
+        self.images_dir = images_dir
+        self.config_file = config_file
+        self.reserved = {os.path.normcase(os.path.abspath(path)) for path in reserved}
+        self.auto_discover = auto_discover
+        self.check_interval = check_interval
+        self.memory_budget = memory_budget
+        self.on_evict = on_evict
+        self._mapping = dict(mapping)
+        self._lock = threading.Lock()
+        # 常驻的表情包 -> 估算的内存占用，按最近使用排序
+        self._resident: "OrderedDict[str, int]" = OrderedDict()
+        self._resident_bytes = 0
+        self.reloads = 0
+        self.loads = 0
+        self.evictions = 0
+        self._signature = self._read_signature()
+        self._table = self._scan()
+        self._checked_at = time.monotonic()
+
+    def _read_signature(self) -> Tuple:
+        """配置文件和图片目录的修改时间，增删文件或表情包都会改变目录的修改时间"""
+        stamps = []
+        paths = [self.config_file] if self.config_file else []
+        paths.append(self.images_dir)
+        if self.auto_discover:
+            paths.extend(entry.path for entry in self._subdirs())
+        for path in paths:
+            try:
+                stamps.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                stamps.append((path, None))
+        return tuple(stamps)
+
+    def _subdirs(self) -> List[os.DirEntry]:
+        try:
+            with os.scandir(self.images_dir) as entries:
+                return sorted((entry for entry in entries if entry.is_dir()), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return []
+
+    def _images(self, directory: str) -> List[str]:
+        try:
+            with os.scandir(directory) as entries:
+                names = sorted(entry.name for entry in entries if entry.is_file())
+        except FileNotFoundError:
+            return []
+        paths = []
+        for name in names:
+            path = os.path.join(directory, name)
+            if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.normcase(path) not in self.reserved:
+                paths.append(path)
+        return paths
+
+    def _read_mapping(self) -> Dict[str, str]:
+        """从配置文件重新读取emotion_mapping，读取失败时沿用上一次的映射"""
+        if not self.config_file or not os.path.exists(self.config_file):
+            return self._mapping
+        try:
+            with open(self.config_file, "r", encoding="utf-8") as f:
+                mapping = toml.load(f).get("emotion_mapping")
+        except Exception as e:
+            log.error(f"重新读取表情配置失败，沿用原配置: {e}")
+            return self._mapping
+        return dict(mapping) if isinstance(mapping, dict) else self._mapping
+
+    def _scan(self) -> EmotionTable:
+        mapping: Dict[str, str] = {}
+        packs: Dict[str, List[str]] = {ROOT_PACK: []}
+        pack_of: Dict[str, str] = {}
+
+        def register(tag: str, path: str, pack: str) -> None:
+            mapping.setdefault(tag, path)
+            if path not in pack_of:
+                pack_of[path] = pack
+                packs.setdefault(pack, []).append(path)
+
+        for tag, filename in self._mapping.items():
+            register(tag, os.path.join(self.images_dir, filename), ROOT_PACK)
+        if self.auto_discover:
+            configured = set(pack_of)
+            for path in self._images(self.images_dir):
+                if path not in configured:
+                    register(f"#{os.path.splitext(os.path.basename(path))[0]}#", path, ROOT_PACK)
+            for entry in self._subdirs():
+                for path in self._images(entry.path):
+                    register(f"#{entry.name}/{os.path.splitext(os.path.basename(path))[0]}#", path, entry.name)
+
+        return EmotionTable(
+            mapping=mapping,
+            packs={name: tuple(paths) for name, paths in packs.items()},
+            pack_of=pack_of,
+            parser=EmotionTagParser(mapping)
+        )
+
+    def table(self) -> EmotionTable:
+        """获取当前的表情映射，超过检查间隔时检查配置和目录是否变化"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._table
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._table
+            self._checked_at = now
+            signature = self._read_signature()
+            if signature == self._signature:
+                return self._table
+            self._signature = signature
+            self._mapping = self._read_mapping()
+            old, self._table = self._table, self._scan()
+            self.reloads += 1
+            # 已删除的表情包不再常驻
+            removed = [pack for pack in self._resident if pack not in self._table.packs]
+            evicted = self._evict_packs(removed, old)
+        log.info(f"表情差分已重新加载: {len(self._table.mapping)}个表情，{len(self._table.packs)}个表情包")
+        self._release(evicted)
+        return self._table
+
+    @property
+    def mapping(self) -> Dict[str, str]:
+        return self.table().mapping
+
+    @staticmethod
+    def _estimate_bytes(paths: Iterable[str]) -> int:
+        """只读取图片头估算解码后的占用：RGBA底图及其合成后的静态画面"""
+        total = 0
+        for path in paths:
+            try:
+                with Image.open(path) as image:
+                    total += image.width * image.height * 4 * 2
+            except Exception:
+                continue
+        return total
+
+    def _evict_packs(self, packs: Iterable[str], table: EmotionTable) -> List[str]:
+        paths = []
+        for pack in packs:
+            self._resident_bytes -= self._resident.pop(pack)
+            self.evictions += 1
+            paths.extend(table.packs.get(pack, ()))
+        return paths
+
+    def _release(self, paths: List[str]) -> None:
+        if paths and self.on_evict is not None:
+            self.on_evict(paths)
+
+    def touch(self, path: str) -> None:
+        """记录底图被使用，表情包首次使用时计入常驻内存并按预算淘汰冷门表情包"""
+        table = self._table
+        pack = table.pack_of.get(path)
+        if pack is None or pack == ROOT_PACK:
+            return
+        with self._lock:
+            if pack in self._resident:
+                self._resident.move_to_end(pack)
+                return
+        size = self._estimate_bytes(table.packs[pack])
+        with self._lock:
+            if pack in self._resident:
+                return
+            self._resident[pack] = size
+            self._resident_bytes += size
+            self.loads += 1
+            cold = []
+            if self.memory_budget > 0:
+                total = self._resident_bytes
+                for name, pack_bytes in self._resident.items():
+                    if total <= self.memory_budget or name == pack:
+                        break
+                    cold.append(name)
+                    total -= pack_bytes
+            evicted = self._evict_packs(cold, table)
+        if cold:
+            log.info(f"表情包超出内存预算，释放: {', '.join(cold)}")
+        self._release(evicted)
+
+    def packs(self) -> List[Dict[str, Any]]:
+        """各表情包的表情数和常驻状态"""
+        table = self.table()
+        with self._lock:
+            return [
+                {
+                    "name": name,
+                    "emotions": sum(1 for path in table.mapping.values() if table.pack_of.get(path) == name),
+                    "resident": name == ROOT_PACK or name in self._resident,
+                    "bytes": self._resident.get(name, 0)
+                }
+                for name in table.packs
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "emotions": len(self._table.mapping),
+                "packs": len(self._table.packs),
+                "resident_packs": len(self._resident),
+                "resident_bytes": self._resident_bytes,
+                "memory_budget": self.memory_budget,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "reloads": self.reloads
+            }
@@ -0,0 +1,53 @@
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+# 字典树中标记标签结束的键
+_END = ""
+
+
+def _trie_pattern(node: Dict[str, dict]) -> str:
+    """把字典树转换为正则，公共前缀只匹配一次，同一位置优先匹配更长的标签"""
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char != _END]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if _END in node:
+        if len(branches) == 1:
+            pattern = "(?:" + pattern + ")"
+        pattern += "?"
+    return pattern
+
+
+class EmotionTagParser:
+    """表情标签解析器
+
+    启动时把全部标签编译为一个按字典树展开的正则，解析时只扫描一遍文本，
+    同时找出位置最靠后的标签并删除所有标签，耗时与标签数量基本无关。
+    """
+
+    def __init__(self, tags: Iterable[str]):
+        trie: Dict[str, dict] = {}
+        for tag in tags:
+            if not tag:
+                continue
+            node = trie
+            for char in tag:
+                node = node.setdefault(char, {})
+            node[_END] = {}
+        self._pattern = re.compile(_trie_pattern(trie)) if trie else None
+
+    def parse(self, text: str) -> Tuple[Optional[str], str]:
+        """返回（位置最靠后的标签，删除全部标签后的文本），没有标签时标签为None"""
+        if self._pattern is None or not text:
+            return None, text
+        parts = []
+        last_tag = None
+        pos = 0
+        for match in self._pattern.finditer(text):
+            parts.append(text[pos:match.start()])
+            pos = match.end()
+            last_tag = match.group()
+        if last_tag is None:
+            return None, text
+        parts.append(text[pos:])
+        return last_tag, "".join(parts).strip()
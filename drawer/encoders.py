@@ -0,0 +1,118 @@
+import io
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional
+from PIL import Image
+from core.core import config
+
+# 支持的输出格式：扩展名和MIME类型
+OUTPUT_FORMATS: Dict[str, Dict[str, str]] = {
+    "png": {"extension": "png", "media_type": "image/png"},
+    "png8": {"extension": "png", "media_type": "image/png"},
+    "webp": {"extension": "webp", "media_type": "image/webp"},
+    "jpeg": {"extension": "jpg", "media_type": "image/jpeg"},
+    "gif": {"extension": "gif", "media_type": "image/gif"},
+}
+
+# 可以输出动画的格式
+ANIMATED_FORMATS = ("webp", "gif")
+
+
+@dataclass(frozen=True)
+class EncoderOptions:
+    """输出编码参数"""
+    format: str = "png"  # png、png8（调色板量化）、webp、jpeg或gif
+    png_compress_level: int = 6  # PNG的zlib压缩级别，0-9，越小越快
+    png_optimize: bool = False  # PNG额外的压缩优化，开销很大
+    png8_colors: int = 256  # 调色板PNG的颜色数
+    webp_lossless: bool = False  # WebP无损模式
+    webp_quality: int = 80  # WebP质量，无损模式下表示压缩力度
+    webp_method: int = 4  # WebP编码速度与压缩率的权衡，0最快，6最慢
+    jpeg_quality: int = 90  # JPEG质量
+
+    @property
+    def extension(self) -> str:
+        return OUTPUT_FORMATS[self.format]["extension"]
+
+    @property
+    def media_type(self) -> str:
+        return OUTPUT_FORMATS[self.format]["media_type"]
+
+    def with_format(self, output_format: Optional[str]) -> "EncoderOptions":
+        """返回使用指定格式的编码参数，格式为空时返回自身"""
+        if not output_format or output_format == self.format:
+            return self
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {output_format}")
+        return replace(self, format=output_format)
+
+
+def _encode_png(img: Image.Image, options: EncoderOptions, output: io.BytesIO) -> None:
+    img.save(output, format="PNG", compress_level=options.png_compress_level, optimize=options.png_optimize)
+
+
+def _encode_png8(img: Image.Image, options: EncoderOptions, output: io.BytesIO) -> None:
+    # 带透明通道时只能使用FASTOCTREE量化
+    method = Image.Quantize.FASTOCTREE if img.mode == "RGBA" else Image.Quantize.MEDIANCUT
+    quantized = img.quantize(colors=options.png8_colors, method=method)
+    quantized.save(output, format="PNG", compress_level=options.png_compress_level, optimize=options.png_optimize)
+
+
+def _encode_webp(img: Image.Image, options: EncoderOptions, output: io.BytesIO) -> None:
+    img.save(output, format="WEBP", lossless=options.webp_lossless,
+             quality=options.webp_quality, method=options.webp_method)
+
+
+def _encode_jpeg(img: Image.Image, options: EncoderOptions, output: io.BytesIO) -> None:
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.save(output, format="JPEG", quality=options.jpeg_quality)
+
+
+def _encode_gif(img: Image.Image, options: EncoderOptions, output: io.BytesIO) -> None:
+    img.save(output, format="GIF")
+
+
+ENCODERS: Dict[str, Callable[[Image.Image, EncoderOptions, io.BytesIO], None]] = {
+    "png": _encode_png,
+    "png8": _encode_png8,
+    "webp": _encode_webp,
+    "jpeg": _encode_jpeg,
+    "gif": _encode_gif,
+}
+
+
+def encode_image(img: Image.Image, options: EncoderOptions) -> bytes:
+    """按编码参数把图像编码为字节"""
+    with io.BytesIO() as output:
+        ENCODERS[options.format](img, options, output)
+        return output.getvalue()
+
+
+def encode_animation(frames: List[Image.Image], durations: List[int], loop: int, options: EncoderOptions) -> bytes:
+    """把多帧图像编码为动画WebP或GIF"""
+    if options.format not in ANIMATED_FORMATS:
+        raise ValueError(f"输出格式不支持动画: {options.format}")
+    with io.BytesIO() as output:
+        if options.format == "webp":
+            frames[0].save(output, format="WEBP", save_all=True, append_images=frames[1:],
+                           duration=durations, loop=loop, lossless=options.webp_lossless,
+                           quality=options.webp_quality, method=options.webp_method)
+        else:
+            frames = [frame.convert("RGB") if frame.mode == "RGBA" else frame for frame in frames]
+            frames[0].save(output, format="GIF", save_all=True, append_images=frames[1:],
+                           duration=durations, loop=loop)
+        return output.getvalue()
+
+
+def load_encoder_options() -> EncoderOptions:
+    """从image_config读取默认编码参数"""
+    options = EncoderOptions(
+        png_compress_level=config.get("image_config.png_compress_level", 6),
+        png_optimize=config.get("image_config.png_optimize", False),
+        png8_colors=config.get("image_config.png8_colors", 256),
+        webp_lossless=config.get("image_config.webp_lossless", False),
+        webp_quality=config.get("image_config.webp_quality", 80),
+        webp_method=config.get("image_config.webp_method", 4),
+        jpeg_quality=config.get("image_config.jpeg_quality", 90)
+    )
+    return options.with_format(config.get("image_config.output_format", "png"))
@@ -0,0 +1,82 @@
+import io
+import os
+import threading
+from typing import Dict, Optional, Union
+from PIL import ImageFont
+from core.core import log
+
+FontType = Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]
+
+# 字体文件缺失时的后备字体
+FALLBACK_FONT = "DejaVuSans.ttf"
+
+
+class FontRegistry:
+    """按字号缓存的字体对象池
+
+    字体文件只读取一次，所有字号共享同一份内存中的字体数据，
+    排版过程中不再访问文件系统。
+    """
+
+    def __init__(self, font_file: str):
+        self.font_file = font_file
+        self._font_data: Optional[bytes] = None
+        self._use_default = False
+        self._fonts: Dict[int, FontType] = {}
+        self._lock = threading.Lock()
+        self._load_font_data()
+
+    def _load_font_data(self) -> None:
+        """读取字体文件，失败时依次回退到DejaVu和Pillow内置字体"""
+        if os.path.exists(self.font_file):
+            with open(self.font_file, "rb") as f:
+                self._font_data = f.read()
+            return
+        try:
+            fallback = ImageFont.truetype(FALLBACK_FONT, size=12)
+            with open(fallback.path, "rb") as f:
+                self._font_data = f.read()
+            log.warning(f"字体文件不存在，使用后备字体: {fallback.path}")
+        except Exception:
+            self._use_default = True
+            log.warning(f"字体文件不存在且未找到{FALLBACK_FONT}，使用Pillow内置字体")
+
+    def get(self, size: int) -> FontType:
+        """获取指定字号的字体对象"""
+        font = self._fonts.get(size)
+        if font is not None:
+            return font
+        with self._lock:
+            font = self._fonts.get(size)
+            if font is None:
+                if self._use_default:
+                    font = ImageFont.load_default()
+                else:
+                    # BytesIO直接共享同一个bytes对象，各字号之间不会复制字体数据
+                    font = ImageFont.truetype(io.BytesIO(self._font_data), size=size)
+                self._fonts[size] = font
+            return font
+
+    def warm_up(self, min_size: int, max_size: int) -> None:
+        """预先创建字号范围内的全部字体对象"""
+        for size in range(min_size, max_size + 1):
+            self.get(size)
+        log.info(f"字体预热完成: {min_size}-{max_size}")
+
+    def __len__(self) -> int:
+        return len(self._fonts)
+
+
+# 进程级字体注册表，按字体文件路径共享
+_registries: Dict[str, FontRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_font_registry(font_file: str) -> FontRegistry:
+    """获取字体文件对应的进程级字体注册表"""
+    with _registries_lock:
+        registry = _registries.get(font_file)
+        if registry is None:
+            registry = FontRegistry(font_file)
+            _registries[font_file] = registry
+        return registry
@@ -0,0 +1,36 @@
+import io
+import math
+from typing import Tuple
+from PIL import Image
+
+
+class ImageTooLarge(ValueError):
+    """上传图片超过字节数或像素数限制"""
+
+
+def open_image(data: bytes, max_pixels: int = 0) -> Image.Image:
+    """只解析图片头并检查像素数，像素数据在使用时才解码"""
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if max_pixels > 0 and width * height > max_pixels:
+        raise ImageTooLarge(f"图片像素数过大: {width}x{height}，上限为{max_pixels}")
+    return image
+
+
+def fit_size(size: Tuple[int, int], box: Tuple[int, int], allow_upscale: bool = True) -> Tuple[int, int]:
+    """等比缩放到恰好放入box的尺寸"""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height)
+    if not allow_upscale and scale > 1:
+        scale = 1
+    return int(width * scale), int(height * scale)
+
+
+def draft_for_size(image: Image.Image, size: Tuple[int, int], reducing_gap: float) -> None:
+    """尚未解码的JPEG按DCT缩放直接解码到不小于目标尺寸reducing_gap倍的大小
+
+    已解码或不支持draft的图片不做处理。
+    """
+    if reducing_gap <= 0 or image.format != "JPEG":
+        return
+    image.draft(image.mode, (math.ceil(size[0] * reducing_gap), math.ceil(size[1] * reducing_gap)))
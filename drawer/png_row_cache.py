@@ -0,0 +1,178 @@
+import io
+import struct
+import threading
+import weakref
+import zlib
+from typing import Dict, List, Tuple
+from PIL import Image
+from drawer.compositor import DirtyRegion, StaticFrame
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# zlib流头：deflate、32K窗口，(0x78 * 256 + 0x01) % 31 == 0
+_ZLIB_HEADER = b"\x78\x01"
+# 同步刷新后追加一个空的最终块，结束deflate流
+_DEFLATE_END = b"\x03\x00"
+_ADLER_BASE = 65521
+_BYTES_PER_PIXEL = {"RGB": 3, "RGBA": 4}
+
+# 压缩段：（原始deflate数据，adler32，未压缩长度）
+Segment = Tuple[bytes, int, int]
+
+
+def _chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+
+def adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    """由两段数据各自的adler32计算拼接后的adler32，与zlib的adler32_combine相同"""
+    rem = len2 % _ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xffff) + _ADLER_BASE - 1) % _ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + _ADLER_BASE - rem) % _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def filtered_scanlines(image: Image.Image) -> Tuple[bytes, bytes]:
+    """用Pillow以不压缩模式编码，返回（IDAT之前的文件头，已滤波的扫描行）
+
+    Pillow按行自适应选择滤波器，不压缩时编码开销几乎只有滤波本身。
+    """
+    with io.BytesIO() as output:
+        image.save(output, format="PNG", compress_level=0)
+        data = output.getvalue()
+    pos = len(_PNG_SIGNATURE)
+    header_end = None
+    idat = []
+    while pos < len(data):
+        length, = struct.unpack(">I", data[pos:pos + 4])
+        tag = data[pos + 4:pos + 8]
+        if tag == b"IDAT":
+            if header_end is None:
+                header_end = pos
+            idat.append(data[pos + 8:pos + 8 + length])
+        pos += length + 12
+    return data[:header_end], zlib.decompress(b"".join(idat))
+
+
+def _deflate(data: bytes, level: int) -> bytes:
+    """压缩为以同步刷新结尾的原始deflate段，可以与其他段直接拼接"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class _FrameRows:
+    """一张静态画面的已滤波扫描行，按固定行数分块压缩"""
+
+    def __init__(self, image: Image.Image, rows_per_chunk: int):
+        self.image = image
+        self.width, self.height = image.size
+        self.stride = self.width * _BYTES_PER_PIXEL[image.mode] + 1
+        self.rows_per_chunk = rows_per_chunk
+        self.header, self.filtered = filtered_scanlines(image)
+        self.chunk_count = -(-self.height // rows_per_chunk)
+        # 压缩级别 -> 各分块的压缩段
+        self._chunks: Dict[int, List[Segment]] = {}
+        # （压缩级别，分块序号） -> 首行改为None滤波的压缩段，用于紧接重绘区域之后的分块
+        self._detached: Dict[Tuple[int, int], Segment] = {}
+        self._lock = threading.Lock()
+
+    def raw_row(self, y: int) -> bytes:
+        """以None滤波表示的第y行"""
+        return b"\x00" + self.image.crop((0, y, self.width, y + 1)).tobytes()
+
+    def _chunk_data(self, index: int) -> bytes:
+        start = index * self.rows_per_chunk * self.stride
+        end = min((index + 1) * self.rows_per_chunk, self.height) * self.stride
+        return self.filtered[start:end]
+
+    def chunks(self, level: int) -> List[Segment]:
+        with self._lock:
+            chunks = self._chunks.get(level)
+            if chunks is None:
+                chunks = []
+                for index in range(self.chunk_count):
+                    data = self._chunk_data(index)
+                    chunks.append((_deflate(data, level), zlib.adler32(data), len(data)))
+                self._chunks[level] = chunks
+            return chunks
+
+    def detached(self, level: int, index: int) -> Segment:
+        """首行不依赖上一行的分块：上一行被重绘时原来的滤波结果失效"""
+        key = (level, index)
+        with self._lock:
+            segment = self._detached.get(key)
+            if segment is None:
+                y = index * self.rows_per_chunk
+                data = self.raw_row(y) + self._chunk_data(index)[self.stride:]
+                segment = (_deflate(data, level), zlib.adler32(data), len(data))
+                self._detached[key] = segment
+            return segment
+
+
+class PngRowCache:
+    """静态扫描行缓存的PNG编码器
+
+    同一表情的输出只有素描本区域所在的几行会变化。静态画面的扫描行只滤波、压缩一次，
+    每次请求只对重绘区域覆盖的行滤波和压缩，再与缓存的压缩段拼接成完整的zlib流。
+    重绘区域的首行以及紧随其后的一行使用None滤波，解码结果与完整编码逐像素一致。
+    """
+
+    def __init__(self, rows_per_chunk: int = 16):
+        # 每块行数越小，重绘区域对齐后多压缩的行越少；过小时分块之间无法共享压缩字典
+        self.rows_per_chunk = rows_per_chunk
+        self._frames: "weakref.WeakKeyDictionary[StaticFrame, _FrameRows]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supports(frame: StaticFrame) -> bool:
+        """只缓存被复用的静态画面，临时画面建立行缓存得不偿失"""
+        return frame.shared and frame.image.mode in _BYTES_PER_PIXEL
+
+    def _rows(self, frame: StaticFrame) -> _FrameRows:
+        rows = self._frames.get(frame)
+        if rows is None:
+            with self._lock:
+                rows = self._frames.get(frame)
+                if rows is None:
+                    rows = _FrameRows(frame.image, self.rows_per_chunk)
+                    self._frames[frame] = rows
+        return rows
+
+    def encode(self, region: DirtyRegion, level: int = 6) -> bytes:
+        """编码重绘后的完整画面"""
+        rows = self._rows(region.frame)
+        chunks = rows.chunks(level)
+        step = rows.rows_per_chunk
+
+        # 重绘区域按分块对齐
+        first = region.rect[1] // step
+        last = min(-(-region.rect[3] // step), rows.chunk_count)
+        y0, y1 = first * step, min(last * step, rows.height)
+
+        # 只在重绘行上合成，按None滤波重写首行后压缩
+        band = region.frame.image.crop((0, y0, rows.width, y1))
+        band.paste(region.finish_tile(), (region.rect[0], region.rect[1] - y0))
+        _, band_filtered = filtered_scanlines(band)
+        band_data = b"\x00" + band.crop((0, 0, rows.width, 1)).tobytes() + band_filtered[rows.stride:]
+
+        parts = [_ZLIB_HEADER]
+        adler = 1
+        for data, chunk_adler, length in chunks[:first]:
+            parts.append(data)
+            adler = adler32_combine(adler, chunk_adler, length)
+        parts.append(_deflate(band_data, level))
+        adler = zlib.adler32(band_data, adler)
+        if last < rows.chunk_count:
+            tail = [rows.detached(level, last), *chunks[last + 1:]]
+            for data, chunk_adler, length in tail:
+                parts.append(data)
+                adler = adler32_combine(adler, chunk_adler, length)
+        parts.append(_DEFLATE_END)
+        parts.append(struct.pack(">I", adler))
+
+        return b"".join((rows.header, _chunk(b"IDAT", b"".join(parts)), _chunk(b"IEND", b"")))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"frames": len(self._frames)}
@@ -0,0 +1,119 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class FileDigests:
+    """文件内容摘要，按文件大小和修改时间缓存，超过检查间隔才重新stat
+
+    缓存键使用底图和字体的内容摘要而不是路径，文件被替换后旧结果自动失效，
+    不同进程、不同部署目录下相同的输入也得到相同的键。
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        # 路径 -> （检查时间，大小，修改时间，摘要）
+        self._digests: Dict[str, Tuple[float, int, int, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Optional[str]) -> Optional[str]:
+        """返回文件内容的SHA-256，路径为空或文件不存在时返回None"""
+        if path is None:
+            return None
+        now = time.monotonic()
+        entry = self._digests.get(path)
+        if entry is not None and now - entry[0] < self.check_interval:
+            return entry[3]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry is not None and (entry[1], entry[2]) == (stat.st_size, stat.st_mtime_ns):
+            digest = entry[3]
+        else:
+            with open(path, "rb") as f:
+                digest = hashlib.file_digest(f, "sha256").hexdigest()
+        with self._lock:
+            self._digests[path] = (now, stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+
+class RenderCache:
+    """渲染结果缓存
+
+    以内容摘要为键缓存编码后的图片字节，按条目数和总字节数做LRU淘汰，
+    超过存活时间的条目在访问时失效。
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # 存活时间，为0时条目不会过期
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """根据渲染参数生成缓存键"""
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存，命中时移动到最近使用位置"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at and expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        """写入缓存并按容量淘汰最久未使用的条目"""
+        size = len(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
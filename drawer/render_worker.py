@@ -0,0 +1,136 @@
+import hashlib
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from core.core import config
+from drawer.animation import RawImage, decode_frames
+from drawer.compositor import Rect
+from drawer.image_input import open_image
+from drawer.sketchbook_drawer import RenderOutput, SketchbookGenerator
+
+# 当前进程使用的素描本生成器，线程池模式下与API共享同一个实例
+_generator: Optional[SketchbookGenerator] = None
+
+
+@dataclass(frozen=True)
+class RenderJob:
+    """提交给渲染工作池的任务描述，只包含可以低成本pickle的数据"""
+    text: str = ""
+    emotion: str = ""
+    image_bytes: Optional[bytes] = None
+    output_format: Optional[str] = None  # 为空时使用配置中的默认输出格式
+
+
+@dataclass(frozen=True)
+class AnimationPlan:
+    """动图渲染计划：解码并去重后的帧，以及逐帧渲染和编码需要的参数"""
+    image_file: str
+    overlay_file: Optional[str]
+    output_format: str
+    frames: Tuple[RawImage, ...] = ()
+    durations: Tuple[int, ...] = ()
+    loop: int = 0
+    cache_key: Optional[str] = None
+    result: Optional[bytes] = None  # 命中渲染缓存时直接返回的结果
+
+
+@dataclass(frozen=True)
+class FrameBatchJob:
+    """一批动图帧的渲染任务"""
+    image_file: str
+    overlay_file: Optional[str]
+    frames: Tuple[RawImage, ...]
+
+
+def bind_generator(generator: SketchbookGenerator) -> None:
+    """指定当前进程使用的生成器"""
+    global _generator
+    _generator = generator
+
+
+def init_worker() -> None:
+    """工作进程初始化：预加载底图和字体"""
+    global _generator
+    if _generator is None:
+        _generator = SketchbookGenerator()
+
+
+def execute_job(job: RenderJob) -> RenderOutput:
+    """执行渲染任务并返回编码后的图片及其缓存键"""
+    if _generator is None:
+        init_worker()
+
+    image = None
+    image_digest = None
+    if job.image_bytes is not None:
+        # 只读取图片头，像素在粘贴时按目标尺寸解码
+        image = open_image(job.image_bytes, config.get("image_config.upload_max_pixels", 50_000_000))
+        image_digest = hashlib.sha256(job.image_bytes).hexdigest()
+
+    return _generator.render_output(_generator.build_spec(
+        text=job.text,
+        image=image,
+        emotion=job.emotion,
+        image_digest=image_digest,
+        output_format=job.output_format
+    ))
+
+
+def plan_animation(job: RenderJob) -> AnimationPlan:
+    """解码动图的各帧，合并相邻的相同帧，并按帧数、时长和像素数上限截断"""
+    if _generator is None:
+        init_worker()
+
+    max_pixels = config.get("image_config.upload_max_pixels", 50_000_000)
+    image = open_image(job.image_bytes, max_pixels)
+    spec = _generator.build_spec(
+        image=image,
+        emotion=job.emotion,
+        image_digest=hashlib.sha256(job.image_bytes).hexdigest(),
+        output_format=job.output_format
+    )
+    cache_key = _generator.animation_cache_key(spec) if _generator.caching else None
+    cached = _generator.cached_render(cache_key)
+    if cached is not None:
+        return AnimationPlan(spec.image_file, spec.overlay_file, spec.encoder.format, cache_key=cache_key, result=cached)
+
+    # 帧在解码后立即缩小到粘贴尺寸，只有缩小后的帧在进程间传递
+    frames, durations = decode_frames(image, max_pixels=max_pixels, fit=_generator.fit_frame,
+                                      **_generator.ANIMATION_OPTIONS)
+    return AnimationPlan(
+        image_file=spec.image_file,
+        overlay_file=spec.overlay_file,
+        output_format=spec.encoder.format,
+        frames=tuple(RawImage.from_image(frame) for frame in frames),
+        durations=tuple(durations),
+        loop=image.info.get("loop", 0),
+        cache_key=cache_key
+    )
+
+
+def render_frame_batch(job: FrameBatchJob) -> List[Tuple[Rect, RawImage]]:
+    """渲染一批动图帧，返回每帧的重绘区域"""
+    if _generator is None:
+        init_worker()
+
+    tiles = []
+    for frame in job.frames:
+        rect, tile = _generator.render_frame_tile(job.image_file, job.overlay_file, frame.to_image())
+        tiles.append((rect, RawImage.from_image(tile)))
+    return tiles
+
+
+def encode_animation_job(plan: AnimationPlan, tiles: List[Tuple[Rect, RawImage]]) -> RenderOutput:
+    """合成各帧并编码为动画，结果写入渲染缓存"""
+    if _generator is None:
+        init_worker()
+
+    encoder = _generator.encoder.with_format(plan.output_format)
+    data = _generator.compose_animation(
+        plan.image_file,
+        plan.overlay_file,
+        [(rect, tile.to_image()) for rect, tile in tiles],
+        list(plan.durations),
+        plan.loop,
+        encoder
+    )
+    return _generator.store_render(plan.cache_key, data, encoder.extension)
@@ -1,12 +1,47 @@
 import os
-import io
-from typing import Union, Tuple, Optional, Literal
-from PIL import Image, ImageDraw, ImageFont
+import math
+import unicodedata
+from dataclasses import dataclass, replace
+from typing import Dict, List, Union, Tuple, Optional, Literal
+from PIL import Image, ImageDraw
 from core.core import config, internal_config, log  # 导入internal_config
+from core.disk_cache import DiskRenderCache
+from drawer.asset_store import AssetStore
+from drawer.compositor import Compositor, DirtyRegion, Rect, StaticFrame
+from drawer.image_input import fit_size, draft_for_size
+from drawer.emotion_registry import ROOT_PACK, EmotionRegistry
+from drawer.encoders import EncoderOptions, encode_animation, encode_image, load_encoder_options
+from drawer.png_row_cache import PngRowCache
+from drawer.font_registry import get_font_registry
+from drawer.render_cache import FileDigests, RenderCache
+from drawer.single_flight import SingleFlight
+from drawer.thumbnail_cache import ThumbnailCache
+from drawer.text_layout import TextLayoutEngine, FontSizeSolver
 
 Align = Literal["left", "center", "right"]
 VAlign = Literal["top", "middle", "bottom"]
 
+@dataclass(frozen=True)
+class RenderSpec:
+    """单次渲染请求的不可变描述
+
+    请求相关的状态全部放在这里，生成器实例只持有只读的共享资源，
+    因此同一个生成器可以被多个线程同时使用。
+    """
+    image_file: str  # 已解析表情差分的底图文件
+    text: str = ""  # 去除表情标签后的文本
+    image: Optional[Image.Image] = None  # 要粘贴的图片
+    image_digest: Optional[str] = None  # 上传图片原始字节的摘要，用于渲染缓存
+    overlay_file: Optional[str] = None  # 衣袖遮挡层，为None时不遮挡
+    encoder: EncoderOptions = EncoderOptions()  # 输出编码参数
+
+@dataclass(frozen=True)
+class RenderOutput:
+    """渲染结果：编码后的图片，以及可以用来在磁盘缓存中保存和查找它的缓存键"""
+    data: bytes
+    extension: str
+    cache_key: Optional[str] = None  # 无法缓存时为None
+
 class SketchbookGenerator:
     def __init__(self):
         # 使用内部配置中的绝对路径
@@ -21,14 +56,157 @@ class SketchbookGenerator:
         # 从配置中读取启用衣袖遮挡的设置
         self.USE_BASE_OVERLAY = config.get("image_config.enable_sleeve_overlay", True)
         
-        # 从配置中获取差分表情映射
-        self.BASEIMAGE_MAPPING = {}
-        emotion_mapping = config.get("emotion_mapping", {})
-        for key, filename in emotion_mapping.items():
-            self.BASEIMAGE_MAPPING[key] = os.path.join(self.base_images_dir, filename)
+        # 差分表情注册表：配置中的映射加上图片目录中自动发现的表情包，修改后自动重新加载
+        self.emotions = EmotionRegistry(
+            images_dir=self.base_images_dir,
+            mapping=config.get("emotion_mapping", {}),
+            config_file=config.config_file,
+            reserved=[self.BASE_OVERLAY_FILE],
+            auto_discover=config.get("emotion_config.auto_discover", True),
+            check_interval=config.get("emotion_config.check_interval", 2.0),
+            memory_budget=config.get("emotion_config.memory_budget_bytes", 128 * 1024 * 1024),
+            on_evict=self.release_images
+        )
+        
+        # 文本与图片的渲染参数，同时参与渲染缓存键的计算
+        self.TEXT_RENDER_OPTIONS = {"color": (0, 0, 0), "max_font_height": 64}
+        self.IMAGE_RENDER_OPTIONS = {
+            "align": "center",
+            "valign": "middle",
+            "padding": 12,
+            "allow_upscale": True,
+            "keep_alpha": True,
+            "reducing_gap": config.get("image_config.resize_reducing_gap", 3.0)
+        }
+        
+        # 动图输入的帧数和总时长上限，超出部分截断
+        self.ANIMATION_OPTIONS = {
+            "max_frames": config.get("image_config.animation_max_frames", 60),
+            "max_duration": config.get("image_config.animation_max_duration_ms", 10000)
+        }
         
         # 默认底图
-        self.current_image_file = os.path.join(self.base_images_dir, "base.png")
+        self.DEFAULT_IMAGE_FILE = os.path.join(self.base_images_dir, "base.png")
+        
+        # 默认输出编码参数，请求可以单独指定输出格式
+        self.encoder = load_encoder_options()
+        
+        # PNG静态扫描行缓存，只压缩素描本区域所在的行
+        self.png_rows = PngRowCache() if config.get("image_config.png_row_cache", True) else None
+        
+        # 启动时预先解码默认表情包的底图和衣袖遮挡层，其他表情包首次使用时再解码
+        root_images = self.emotions.table().packs[ROOT_PACK]
+        self.assets = AssetStore(check_interval=config.get("image_config.asset_check_interval", 1.0))
+        self.assets.preload([self.DEFAULT_IMAGE_FILE, *root_images, self.BASE_OVERLAY_FILE])
+        
+        # 预先合成每张底图的静态画面，请求只重绘素描本区域
+        self.compositor = Compositor(box=(*self.TEXT_BOX_TOPLEFT, *self.IMAGE_BOX_BOTTOMRIGHT))
+        overlay_file = self.BASE_OVERLAY_FILE if self.USE_BASE_OVERLAY else None
+        for image_file in {self.DEFAULT_IMAGE_FILE, *root_images}:
+            try:
+                self.static_frame(image_file, overlay_file)
+            except FileNotFoundError:
+                pass
+        
+        # 增量文本排版引擎，按字体对象缓存字形步进
+        self.layout = TextLayoutEngine()
+        
+        # 进程级字体对象池，按配置预热全部字号
+        self.fonts = get_font_registry(self.font_file)
+        if config.get("text_config.preload_fonts", True):
+            self.fonts.warm_up(*self.font_size_limits())
+        
+        # 字号求解器，缓存每段文本选定的字号和换行结果
+        self.size_solver = FontSizeSolver(
+            self.layout,
+            self.fonts.get,
+            cache_size=config.get("text_config.layout_cache_size", 4096)
+        )
+        
+        # 渲染结果缓存
+        self.render_cache = None
+        if config.get("cache_config.enabled", True):
+            self.render_cache = RenderCache(
+                max_entries=config.get("cache_config.max_entries", 1024),
+                max_bytes=config.get("cache_config.max_bytes", 64 * 1024 * 1024),
+                ttl_seconds=config.get("cache_config.ttl_seconds", 600)
+            )
+        
+        # 磁盘上的二级渲染结果缓存，多个进程和重启之间共享
+        self.disk_cache = None
+        if config.get("cache_config.disk_enabled", False):
+            self.disk_cache = DiskRenderCache(
+                os.path.join(internal_config.work_dir, "data", "render_cache"),
+                max_bytes=config.get("cache_config.disk_max_bytes", 1024 * 1024 * 1024),
+                max_entries=config.get("cache_config.disk_max_entries", 65536)
+            )
+        
+        # 相同缓存键的并发渲染只执行一次
+        self.flights = SingleFlight()
+        
+        # 缓存键使用的底图、遮挡层和字体文件内容摘要
+        self.file_digests = FileDigests(check_interval=config.get("image_config.asset_check_interval", 1.0))
+        
+        # 已缩放内容图片的缓存，可选按感知哈希识别重新编码的同一张图
+        self.thumbnails = None
+        thumbnail_max_bytes = config.get("cache_config.thumbnail_max_bytes", 32 * 1024 * 1024)
+        if thumbnail_max_bytes > 0:
+            self.thumbnails = ThumbnailCache(
+                max_bytes=thumbnail_max_bytes,
+                perceptual=config.get("cache_config.perceptual_hash", False),
+                max_distance=config.get("cache_config.perceptual_max_distance", 2)
+            )
+    
+    def font_size_limits(self) -> Tuple[int, int]:
+        """获取字体大小限制（下限，上限）"""
+        config_max_font_size = config.get("text_config.max_font_size", 96)
+        config_min_font_size = config.get("text_config.min_font_size", 12)
+        
+        # 确保上限不超过96，下限不低于12
+        max_font_size = min(config_max_font_size, 96)
+        min_font_size = max(config_min_font_size, 12)
+        return min_font_size, max_font_size
+    
+    @property
+    def BASEIMAGE_MAPPING(self) -> Dict[str, str]:
+        """当前的表情标签到底图文件的映射"""
+        return self.emotions.mapping
+    
+    def release_images(self, paths: List[str]) -> None:
+        """释放被淘汰的表情包的底图和静态画面"""
+        self.assets.evict(paths)
+        self.compositor.evict(paths)
+    
+    def static_frame(self,
+                     image_source: Union[str, Image.Image],
+                     image_overlay: Union[str, Image.Image, None] = None
+                    ) -> StaticFrame:
+        """获取底图与遮挡层合成后的静态画面，两者都来自文件时复用缓存"""
+        if isinstance(image_source, Image.Image):
+            base = image_source
+        else:
+            self.emotions.touch(image_source)
+            base = self.assets.get(image_source)
+    
+        overlay = None
+        if image_overlay is not None:
+            if isinstance(image_overlay, Image.Image):
+                overlay = image_overlay
+            else:
+                overlay = self.assets.get_optional(image_overlay)
+    
+        key = None
+        if not isinstance(image_source, Image.Image) and not isinstance(image_overlay, Image.Image):
+            key = (image_source, image_overlay)
+        return self.compositor.frame(base, overlay, key)
+    
+    def encode_region(self, region: DirtyRegion, encoder: Optional[EncoderOptions] = None) -> bytes:
+        """编码重绘后的画面，PNG输出优先复用静态扫描行缓存"""
+        encoder = encoder or self.encoder
+        if (self.png_rows is not None and encoder.format == "png" and not encoder.png_optimize
+                and self.png_rows.supports(region.frame)):
+            return self.png_rows.encode(region, encoder.png_compress_level)
+        return encode_image(region.compose(), encoder)
     
     def draw_text_auto(self, 
                       image_source: Union[str, Image.Image],
@@ -39,21 +217,12 @@ class SketchbookGenerator:
                       valign: VAlign = "middle",
                       line_spacing: float = 0.15,
                       bracket_color: Tuple[int, int, int] = (128, 0, 128),
-                      image_overlay: Union[str, Image.Image, None] = None
+                      image_overlay: Union[str, Image.Image, None] = None,
+                      encoder: Optional[EncoderOptions] = None
                      ) -> bytes:
         """在指定矩形内自适应字号绘制文本"""
-        # 打开图像
-        if isinstance(image_source, Image.Image):
-            img = image_source.copy()
-        else:
-            img = Image.open(image_source).convert("RGBA")
-        draw = ImageDraw.Draw(img)
-    
-        if image_overlay is not None:
-            if isinstance(image_overlay, Image.Image):
-                img_overlay = image_overlay.copy()
-            else:
-                img_overlay = Image.open(image_overlay).convert("RGBA") if os.path.isfile(image_overlay) else None
+        # 获取预先合成的静态画面
+        frame = self.static_frame(image_source, image_overlay)
     
         x1, y1 = self.TEXT_BOX_TOPLEFT
         x2, y2 = self.IMAGE_BOX_BOTTOMRIGHT
@@ -62,90 +231,22 @@ class SketchbookGenerator:
         region_w, region_h = x2 - x1, y2 - y1
     
         # 字体加载
-        def _load_font(size: int) -> ImageFont.FreeTypeFont:
-            if os.path.exists(self.font_file):
-                return ImageFont.truetype(self.font_file, size=size)
-            try:
-                return ImageFont.truetype("DejaVuSans.ttf", size=size)
-            except Exception:
-                return ImageFont.load_default()
+        _load_font = self.fonts.get
     
         # 文本包行
-        def wrap_lines(txt: str, font: ImageFont.FreeTypeFont, max_w: int) -> list:
-            lines = []
-            for para in txt.splitlines() or [""]:
-                has_space = (" " in para)
-                units = para.split(" ") if has_space else list(para)
-                buf = ""
-    
-                def unit_join(a: str, b: str) -> str:
-                    if not a:
-                        return b
-                    return (a + " " + b) if has_space else (a + b)
-    
-                for u in units:
-                    trial = unit_join(buf, u)
-                    w = draw.textlength(trial, font=font)
-                    if w <= max_w:
-                        buf = trial
-                    else:
-                        if buf:
-                            lines.append(buf)
-                        if has_space and len(u) > 1:
-                            tmp = ""
-                            for ch in u:
-                                if draw.textlength(tmp + ch, font=font) <= max_w:
-                                    tmp += ch
-                                else:
-                                    if tmp:
-                                        lines.append(tmp)
-                                    tmp = ch
-                            buf = tmp
-                        else:
-                            if draw.textlength(u, font=font) <= max_w:
-                                buf = u
-                            else:
-                                lines.append(u)
-                                buf = ""
-                if buf != "":
-                    lines.append(buf)
-                if para == "" and (not lines or lines[-1] != ""):
-                    lines.append("")
-            return lines
+        wrap_lines = self.layout.wrap_lines
     
         # 获取字体大小限制
-        config_max_font_size = config.get("text_config.max_font_size", 96)
-        config_min_font_size = config.get("text_config.min_font_size", 12)
-        
-        # 确保上限不超过96，下限不低于12
-        max_font_size = min(config_max_font_size, 96)
-        min_font_size = max(config_min_font_size, 12)
+        min_font_size, max_font_size = self.font_size_limits()
         
-        # 寻找最佳字体大小
-        min_size = min_font_size
-        max_size = max_font_height or max_font_size
-        best_size = 1
-        best_lines = []
-        best_block_h = 0
-        best_line_h = 0
-    
-        while min_size <= max_size:
-            mid_size = (min_size + max_size) // 2
-            font = _load_font(mid_size)
-            lines = wrap_lines(text, font, region_w)
-            
-            # 计算行高和总高度
-            line_h = font.size * (1 + line_spacing)
-            block_h = len(lines) * line_h
-            
-            if block_h <= region_h:
-                best_size = mid_size
-                best_lines = lines
-                best_block_h = block_h
-                best_line_h = line_h
-                min_size = mid_size + 1
-            else:
-                max_size = mid_size - 1
+        # 预测式求解最佳字体大小，相同文本和区域直接复用上次的结果
+        best_size, best_lines = self.size_solver.solve(
+            text, region_w, region_h,
+            min_font_size, max_font_height or max_font_size,
+            line_spacing, cache_tag=self.font_file
+        )
+        best_line_h = best_size * (1 + line_spacing) if best_lines else 0
+        best_block_h = len(best_lines) * best_line_h
     
         if best_size == 0:
             font = _load_font(1)
@@ -186,9 +287,16 @@ class SketchbookGenerator:
         else:
             y_start = y2 - best_block_h
     
-        # 绘制
+        # 排版：先计算每个着色片段的位置，再确定需要重绘的区域
         y = y_start
         in_bracket = False
+        metrics = self.layout.metrics(font)
+        draw_ops = []
+        dirty = (x1, y1, x2, y2)
+        # 字形墨迹可能超出步进宽度和行高，按一个字号的余量估算重绘区域
+        ascent, descent = font.getmetrics()
+        line_ink_h = ascent + descent
+        ink_margin = font.size + 1
     
         for line in best_lines:
             if not line:  # 处理空行
@@ -199,7 +307,7 @@ class SketchbookGenerator:
             color_segments, in_bracket = parse_color_segments(line, in_bracket)
     
             # 计算行的总宽度和起始X坐标
-            total_width = sum(draw.textlength(seg[0], font=font) for seg in color_segments)
+            total_width = sum(metrics.width(seg[0]) for seg in color_segments)
             if align == "left":
                 x = x1
             elif align == "center":
@@ -207,24 +315,36 @@ class SketchbookGenerator:
             else:  # right
                 x = x2 - total_width
     
-            # 绘制每个着色片段
+            # 记录每个着色片段，重绘区域需覆盖字形墨迹和绘制起点
             for text_seg, text_color in color_segments:
-                draw.text((x, y), text_seg, font=font, fill=text_color)
-                x += draw.textlength(text_seg, font=font)
+                seg_w = metrics.width(text_seg)
+                draw_ops.append((x, y, text_seg, text_color))
+                if any(unicodedata.combining(ch) for ch in text_seg):
+                    # 组合字符可能层层叠加，墨迹范围只能精确测量
+                    left, top, right, bottom = font.getbbox(text_seg)
+                    left, top = min(left, 0) - ink_margin, min(top, 0) - ink_margin
+                    right, bottom = max(right, seg_w) + ink_margin, max(bottom, line_ink_h) + ink_margin
+                else:
+                    left, top, right, bottom = -ink_margin, -ink_margin, seg_w + ink_margin, line_ink_h + ink_margin
+                dirty = (
+                    min(dirty[0], math.floor(x + left)),
+                    min(dirty[1], math.floor(y + top)),
+                    max(dirty[2], math.ceil(x + right)),
+                    max(dirty[3], math.ceil(y + bottom))
+                )
+                x += seg_w
     
             y += best_line_h
     
-        # 应用覆盖层
-        if image_overlay is not None:
-            if img_overlay:
-                img.paste(img_overlay, (0, 0), img_overlay if img_overlay.mode == 'RGBA' else None)
-    
-        # 保存为PNG字节流
-        with io.BytesIO() as output:
-            img.save(output, format="PNG")
-            png_bytes = output.getvalue()
+        # 只在重绘区域内绘制，坐标平移后保持非负，与在整张画布上绘制结果一致
+        region = self.compositor.region(frame, dirty)
+        dx, dy = region.offset
+        draw = ImageDraw.Draw(region.tile)
+        for x, y, text_seg, text_color in draw_ops:
+            draw.text((x - dx, y - dy), text_seg, font=font, fill=text_color)
     
-        return png_bytes
+        # 叠加遮挡层后编码，按编码参数输出，默认为PNG
+        return self.encode_region(region, encoder)
     
     def paste_image_auto(self, 
                         image_source: Union[str, Image.Image],
@@ -234,21 +354,44 @@ class SketchbookGenerator:
                         padding: int = 12,
                         allow_upscale: bool = True,
                         keep_alpha: bool = True,
-                        image_overlay: Union[str, Image.Image, None] = None
+                        image_overlay: Union[str, Image.Image, None] = None,
+                        encoder: Optional[EncoderOptions] = None,
+                        reducing_gap: float = 0,
+                        content_key: Optional[str] = None
                        ) -> bytes:
-        """自动调整图片大小并粘贴到指定区域"""
-        # 打开源图像
-        if isinstance(image_source, Image.Image):
-            img = image_source.copy()
-        else:
-            img = Image.open(image_source).convert("RGBA")
-    
-        # 打开覆盖层图像
-        if image_overlay is not None:
-            if isinstance(image_overlay, Image.Image):
-                img_overlay = image_overlay.copy()
-            else:
-                img_overlay = Image.open(image_overlay).convert("RGBA") if os.path.isfile(image_overlay) else None
+        """自动调整图片大小并粘贴到指定区域
+
+        reducing_gap大于0时，未解码的JPEG按DCT缩放直接解码到接近目标尺寸，
+        其他图片先按整数倍缩小到目标尺寸的reducing_gap倍左右，再做LANCZOS重采样。
+        content_key为内容图片的摘要，提供时复用缩略图缓存，命中时不解码图片。
+        """
+        region = self.paste_content(
+            image_source, content_image, align=align, valign=valign, padding=padding,
+            allow_upscale=allow_upscale, keep_alpha=keep_alpha, image_overlay=image_overlay,
+            reducing_gap=reducing_gap, content_key=content_key
+        )
+        # 叠加遮挡层后编码，按编码参数输出，默认为PNG
+        return self.encode_region(region, encoder)
+    
+    def paste_content(self,
+                      image_source: Union[str, Image.Image],
+                      content_image: Image.Image,
+                      align: Align = "center",
+                      valign: VAlign = "middle",
+                      padding: int = 12,
+                      allow_upscale: bool = True,
+                      keep_alpha: bool = True,
+                      image_overlay: Union[str, Image.Image, None] = None,
+                      reducing_gap: float = 0,
+                      content_key: Optional[str] = None,
+                      fitted: bool = False
+                     ) -> DirtyRegion:
+        """缩放内容图片并粘贴到重绘区域，返回尚未叠加遮挡层的重绘区域
+
+        fitted为True时内容图片已由fit_frame缩放到粘贴尺寸，不再缩放。
+        """
+        # 获取预先合成的静态画面
+        frame = self.static_frame(image_source, image_overlay)
     
         # 获取粘贴区域
         x1, y1 = self.TEXT_BOX_TOPLEFT
@@ -267,23 +410,26 @@ class SketchbookGenerator:
         if effective_width <= 0 or effective_height <= 0:
             raise ValueError("内边距过大，有效粘贴区域为空。")
     
-        # 打开内容图像
-        content_img = content_image.copy()
-    
-        # 计算缩放比例
-        img_width, img_height = content_img.size
-        scale = min(effective_width / img_width, effective_height / img_height)
+        # 查询缩略图缓存
+        effective_size = (effective_width, effective_height)
+        thumbnail_key = None
+        content_img = content_image if fitted else None
+        if content_img is None and self.thumbnails is not None and content_key is not None:
+            thumbnail_key = (content_key, effective_size, allow_upscale, reducing_gap)
+            content_img = self.thumbnails.get(thumbnail_key)
     
-        # 如果不允许放大，且原图已经小于目标区域，则不缩放
-        if not allow_upscale and scale > 1:
-            scale = 1
+        if content_img is None:
+            # 未解码的JPEG直接以接近目标的尺寸解码
+            draft_for_size(content_image, fit_size(content_image.size, effective_size, allow_upscale), reducing_gap)
     
-        # 计算新尺寸
-        new_width = int(img_width * scale)
-        new_height = int(img_height * scale)
+            # 计算新尺寸，不允许放大时小图保持原尺寸
+            new_size = fit_size(content_image.size, effective_size, allow_upscale)
     
-        # 调整图像大小
-        content_img = content_img.resize((new_width, new_height), Image.LANCZOS)
+            # 调整图像大小，resize返回新图像，不修改传入的图片
+            content_img = content_image.resize(new_size, Image.LANCZOS, reducing_gap=reducing_gap or None)
+            if thumbnail_key is not None:
+                self.thumbnails.put(thumbnail_key, content_img)
+        new_width, new_height = content_img.size
     
         # 计算粘贴位置（根据对齐方式）
         if align == "left":
@@ -300,86 +446,245 @@ class SketchbookGenerator:
         else:  # bottom
             paste_y = effective_y2 - new_height
     
+        # 只重绘覆盖素描本区域和粘贴位置的矩形
+        region = self.compositor.region(frame, (paste_x, paste_y, paste_x + new_width, paste_y + new_height))
+        dx, dy = region.offset
+    
         # 处理透明度
         if keep_alpha and content_img.mode == 'RGBA':
-            img.paste(content_img, (paste_x, paste_y), content_img)
+            region.tile.paste(content_img, (paste_x - dx, paste_y - dy), content_img)
         else:
             if content_img.mode == 'RGBA':
                 content_img = content_img.convert('RGB')
-            img.paste(content_img, (paste_x, paste_y))
-    
-        # 应用覆盖层
-        if image_overlay is not None:
-            if img_overlay:
-                img.paste(img_overlay, (0, 0), img_overlay if img_overlay.mode == 'RGBA' else None)
-    
-        # 保存为PNG字节流
-        with io.BytesIO() as output:
-            img.save(output, format="PNG")
-            png_bytes = output.getvalue()
+            region.tile.paste(content_img, (paste_x - dx, paste_y - dy))
+        return region
     
-        return png_bytes
-    
-    def generate_sketchbook(self, text: str = "", image: Optional[Image.Image] = None, emotion: str = "") -> bytes:
-        """生成素描本图片"""
-        # 重置为默认普通标签，确保不记忆上一次的差分
-        default_image_file = os.path.join(self.base_images_dir, "base.png")
-        self.current_image_file = default_image_file
+    def content_box_size(self) -> Tuple[int, int]:
+        """按默认粘贴参数计算的有效粘贴区域大小"""
+        padding = self.IMAGE_RENDER_OPTIONS["padding"]
+        x1, y1 = self.TEXT_BOX_TOPLEFT
+        x2, y2 = self.IMAGE_BOX_BOTTOMRIGHT
+        return x2 - x1 - 2 * padding, y2 - y1 - 2 * padding
+    
+    def draft_content_image(self, content_image: Image.Image) -> None:
+        """按默认粘贴参数为未解码的JPEG设置降采样解码，需要在读取像素之前调用"""
+        options = self.IMAGE_RENDER_OPTIONS
+        effective_size = self.content_box_size()
+        if effective_size[0] > 0 and effective_size[1] > 0:
+            target = fit_size(content_image.size, effective_size, options["allow_upscale"])
+            draft_for_size(content_image, target, options["reducing_gap"])
+    
+    def fit_frame(self, frame: Image.Image) -> Image.Image:
+        """按默认粘贴参数把已解码的动图帧缩放到粘贴尺寸，与paste_content中的缩放相同"""
+        options = self.IMAGE_RENDER_OPTIONS
+        effective_size = self.content_box_size()
+        if effective_size[0] <= 0 or effective_size[1] <= 0:
+            return frame
+        new_size = fit_size(frame.size, effective_size, options["allow_upscale"])
+        return frame.resize(new_size, Image.LANCZOS, reducing_gap=options["reducing_gap"] or None)
+    
+    def resolve_emotion(self, text: str = "", emotion: str = "") -> Tuple[str, str]:
+        """解析表情差分，返回（底图文件，去除表情标签后的文本）"""
+        # 每次都从默认普通底图开始，不记忆上一次的差分
+        image_file = self.DEFAULT_IMAGE_FILE
         
         # 检查是否指定了表情差分
-        if emotion in self.BASEIMAGE_MAPPING:
-            self.current_image_file = self.BASEIMAGE_MAPPING[emotion]
+        emotions = self.emotions.table()
+        if emotion in emotions.mapping:
+            image_file = emotions.mapping[emotion]
         elif text:
-            # 从文本中查找所有表情差分指令，并使用最后一个
-            found_keywords = []
-            for keyword in self.BASEIMAGE_MAPPING.keys():
-                if keyword in text:
-                    found_keywords.append(keyword)
-                    
-            # 如果找到了表情标签，使用最后一个
-            if found_keywords:
-                last_keyword = found_keywords[-1]
-                self.current_image_file = self.BASEIMAGE_MAPPING[last_keyword]
-                # 从文本中删除所有表情标签
-                for keyword in found_keywords:
-                    text = text.replace(keyword, "").strip()
-    
-        png_bytes = None
+            # 一次扫描找出文本中位置最靠后的表情标签，同时删除所有表情标签
+            last_tag, text = emotions.parser.parse(text)
+            if last_tag is not None:
+                image_file = emotions.mapping[last_tag]
+        
+        return image_file, text
+    
+    def build_spec(self, 
+                   text: str = "",
+                   image: Optional[Image.Image] = None,
+                   emotion: str = "",
+                   image_digest: Optional[str] = None,
+                   output_format: Optional[str] = None
+                  ) -> RenderSpec:
+        """根据请求参数构建渲染描述"""
+        image_file, text = self.resolve_emotion(text, emotion)
+        return RenderSpec(
+            image_file=image_file,
+            text=text,
+            image=image,
+            image_digest=image_digest if image is not None else None,
+            overlay_file=self.BASE_OVERLAY_FILE if self.USE_BASE_OVERLAY else None,
+            encoder=self.encoder.with_format(output_format)
+        )
+    
+    def render_cache_key(self, spec: RenderSpec) -> Optional[str]:
+        """根据底图内容、去除标签后的文本和渲染参数计算缓存键，无法缓存时返回None"""
+        if spec.image is not None:
+            if spec.image_digest is None:
+                return None
+            return RenderCache.make_key(
+                "image", self.file_digests.get(spec.image_file), spec.image_digest,
+                self.file_digests.get(spec.overlay_file), sorted(self.IMAGE_RENDER_OPTIONS.items()), spec.encoder
+            )
+        return RenderCache.make_key(
+            "text", self.file_digests.get(spec.image_file), spec.text, self.file_digests.get(spec.overlay_file),
+            self.file_digests.get(self.font_file), self.font_size_limits(),
+            sorted(self.TEXT_RENDER_OPTIONS.items()), spec.encoder
+        )
+    
+    def animation_cache_key(self, spec: RenderSpec) -> Optional[str]:
+        """动图渲染结果的缓存键，没有图片摘要时返回None"""
+        if spec.image_digest is None:
+            return None
+        return RenderCache.make_key(
+            "animation", self.file_digests.get(spec.image_file), spec.image_digest,
+            self.file_digests.get(spec.overlay_file), sorted(self.IMAGE_RENDER_OPTIONS.items()),
+            sorted(self.ANIMATION_OPTIONS.items()), spec.encoder
+        )
+    
+    @property
+    def caching(self) -> bool:
+        return self.render_cache is not None or self.disk_cache is not None
+    
+    def cached_render(self, cache_key: Optional[str]) -> Optional[bytes]:
+        """依次查询内存和磁盘中的渲染结果，磁盘命中时写回内存缓存"""
+        if cache_key is None:
+            return None
+        if self.render_cache is not None:
+            cached = self.render_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        if self.disk_cache is not None:
+            cached = self.disk_cache.get(cache_key)
+            if cached is not None:
+                if self.render_cache is not None:
+                    self.render_cache.put(cache_key, cached)
+                return cached
+        return None
+    
+    def store_render(self, cache_key: Optional[str], data: bytes, extension: str) -> RenderOutput:
+        """把新渲染的结果写入内存和磁盘缓存"""
+        if cache_key is not None:
+            if self.render_cache is not None:
+                self.render_cache.put(cache_key, data)
+            if self.disk_cache is not None:
+                self.disk_cache.put(cache_key, data, extension)
+        return RenderOutput(data, extension, cache_key)
+    
+    def render_frame_tile(self, image_file: str, overlay_file: Optional[str],
+                          content_image: Image.Image) -> Tuple[Rect, Image.Image]:
+        """渲染动图的一帧，只返回重绘区域及其图像，帧已由fit_frame缩放到粘贴尺寸"""
+        region = self.paste_content(image_file, content_image, image_overlay=overlay_file, fitted=True,
+                                    **self.IMAGE_RENDER_OPTIONS)
+        return region.rect, region.finish_tile()
+    
+    def compose_animation(self,
+                          image_file: str,
+                          overlay_file: Optional[str],
+                          tiles: List[Tuple[Rect, Image.Image]],
+                          durations: List[int],
+                          loop: int,
+                          encoder: EncoderOptions
+                         ) -> bytes:
+        """把各帧的重绘区域写回静态画面并编码为动画"""
+        frame = self.static_frame(image_file, overlay_file)
+        frames = []
+        for rect, tile in tiles:
+            image = frame.image.copy()
+            image.paste(tile, (rect[0], rect[1]))
+            frames.append(image)
+        return encode_animation(frames, durations, loop, encoder)
+    
+    def render(self, spec: RenderSpec) -> bytes:
+        """按渲染描述生成素描本图片，不修改生成器状态，可在多个线程中并发调用"""
+        return self.render_output(spec).data
+    
+    def render_output(self, spec: RenderSpec) -> RenderOutput:
+        """按渲染描述生成素描本图片，同时返回缓存键"""
+        extension = spec.encoder.extension
+        # 查询内存和磁盘中的渲染结果，命中时直接返回
+        cache_key = self.render_cache_key(spec) if self.caching else None
+        cached = self.cached_render(cache_key)
+        if cached is not None:
+            return RenderOutput(cached, extension, cache_key)
+    
+        # 感知哈希匹配到之前的图片时，沿用其摘要再查一次渲染结果缓存
+        if spec.image is not None and spec.image_digest is not None and self.thumbnails is not None:
+            if self.thumbnails.perceptual:
+                self.draft_content_image(spec.image)
+            digest = self.thumbnails.resolve(spec.image_digest, spec.image)
+            if digest != spec.image_digest:
+                spec = replace(spec, image_digest=digest)
+                cache_key = self.render_cache_key(spec) if self.caching else None
+                cached = self.cached_render(cache_key)
+                if cached is not None:
+                    return RenderOutput(cached, extension, cache_key)
+    
+        # 同一内容正在渲染时等待其结果，不重复渲染
+        if cache_key is None:
+            return self._render_fresh(spec, cache_key)
+        
+        def render() -> RenderOutput:
+            # 上一次渲染可能在查询缓存之后才写入缓存并移除键，成为首个调用者后再查一次
+            cached = self.cached_render(cache_key)
+            if cached is not None:
+                return RenderOutput(cached, extension, cache_key)
+            return self._render_fresh(spec, cache_key)
+        
+        return self.flights.do(cache_key, render)
+    
+    def _render_fresh(self, spec: RenderSpec, cache_key: Optional[str]) -> RenderOutput:
+        """实际渲染并写入缓存"""
+        image_bytes = None
     
         # 如果有图像，生成带图像的素描本
-        if image is not None:
+        if spec.image is not None:
             try:
-                overlay_file = self.BASE_OVERLAY_FILE if self.USE_BASE_OVERLAY else None
-                png_bytes = self.paste_image_auto(
-                    image_source=self.current_image_file,
-                    content_image=image,
-                    image_overlay=overlay_file,
-                    align="center",
-                    valign="middle",
-                    padding=12,
-                    allow_upscale=True,
-                    keep_alpha=True
+                image_bytes = self.paste_image_auto(
+                    image_source=spec.image_file,
+                    content_image=spec.image,
+                    image_overlay=spec.overlay_file,
+                    encoder=spec.encoder,
+                    content_key=spec.image_digest,
+                    **self.IMAGE_RENDER_OPTIONS
                 )
             except Exception as e:
                 log.error(f"生成图像失败: {e}")
                 raise
     
         # 如果有文本，生成带文本的素描本
-        elif text != "":
+        elif spec.text != "":
             try:
-                overlay_file = self.BASE_OVERLAY_FILE if self.USE_BASE_OVERLAY else None
-                png_bytes = self.draw_text_auto(
-                    image_source=self.current_image_file,
-                    text=text,
-                    image_overlay=overlay_file,
-                    color=(0, 0, 0),
-                    max_font_height=64
+                image_bytes = self.draw_text_auto(
+                    image_source=spec.image_file,
+                    text=spec.text,
+                    image_overlay=spec.overlay_file,
+                    encoder=spec.encoder,
+                    **self.TEXT_RENDER_OPTIONS
                 )
             except Exception as e:
                 log.error(f"生成文本图像失败: {e}")
                 raise
     
-        if png_bytes is None:
+        if image_bytes is None:
             raise ValueError("没有提供文本或图像，无法生成素描本。")
     
-        return png_bytes
\ No newline at end of file
+        return self.store_render(cache_key, image_bytes, spec.encoder.extension)
+    
+    def generate_sketchbook(self, 
+                            text: str = "",
+                            image: Optional[Image.Image] = None,
+                            emotion: str = "",
+                            image_digest: Optional[str] = None,
+                            output_format: Optional[str] = None
+                           ) -> bytes:
+        """生成素描本图片
+
+        image_digest为上传图片原始字节的摘要，提供时图片请求也会走渲染缓存。
+        output_format为空时使用配置中的默认输出格式。
+        """
+        return self.render(self.build_spec(
+            text=text, image=image, emotion=emotion,
+            image_digest=image_digest, output_format=output_format
+        ))
@@ -0,0 +1,268 @@
+import math
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from PIL import ImageFont
+
+FontType = Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]
+
+
+class GlyphMetrics:
+    """单个字体对象（字体+字号）的字形步进和字距对缓存
+
+    基础排版引擎下，一段文本的宽度等于各字形步进之和加上相邻字形的字距调整，
+    因此可以用查表累加代替对整段文本重复调用textlength。
+    """
+
+    def __init__(self, font: FontType):
+        self.font = font
+        self._advances: Dict[str, float] = {}
+        self._kerning: Dict[Tuple[str, str], float] = {}
+        # Raqm会做复杂的字形整形，宽度不能按字形拆分，此时退回整段测量
+        self.exact = not (
+            isinstance(font, ImageFont.FreeTypeFont)
+            and font.layout_engine == ImageFont.Layout.BASIC
+        )
+
+    def advance(self, ch: str) -> float:
+        """单个字符的步进宽度"""
+        width = self._advances.get(ch)
+        if width is None:
+            width = self.font.getlength(ch)
+            self._advances[ch] = width
+        return width
+
+    def kern(self, left: str, right: str) -> float:
+        """相邻两个字符之间的字距调整"""
+        pair = (left, right)
+        delta = self._kerning.get(pair)
+        if delta is None:
+            delta = self.font.getlength(left + right) - self.advance(left) - self.advance(right)
+            self._kerning[pair] = delta
+        return delta
+
+    def width(self, text: str) -> float:
+        """整段文本的宽度，与textlength结果一致"""
+        if self.exact:
+            return self.font.getlength(text)
+        if not text:
+            return 0.0
+        advance = self.advance
+        kern = self.kern
+        total = advance(text[0])
+        prev = text[0]
+        for ch in text[1:]:
+            total += kern(prev, ch) + advance(ch)
+            prev = ch
+        return total
+
+    def join_width(self, left: str, left_width: float, right: str, right_width: float) -> float:
+        """已知两段文本各自宽度时，计算拼接后的宽度"""
+        if not left:
+            return right_width
+        if not right:
+            return left_width
+        if self.exact:
+            return self.font.getlength(left + right)
+        return left_width + self.kern(left[-1], right[0]) + right_width
+
+
+class TextLayoutEngine:
+    """增量文本排版引擎
+
+    按字体对象缓存字形步进表，换行时逐个单元累加宽度，
+    每次换行的开销与文本长度成线性关系，换行结果与逐次调用textlength完全一致。
+    """
+
+    def __init__(self):
+        self._metrics: "weakref.WeakKeyDictionary[FontType, GlyphMetrics]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def metrics(self, font: FontType) -> GlyphMetrics:
+        """获取字体对象的字形度量缓存"""
+        metrics = self._metrics.get(font)
+        if metrics is None:
+            with self._lock:
+                metrics = self._metrics.get(font)
+                if metrics is None:
+                    metrics = GlyphMetrics(font)
+                    self._metrics[font] = metrics
+        return metrics
+
+    def wrap_lines(self, txt: str, font: FontType, max_w: float) -> List[str]:
+        """按最大宽度换行：有空格的段落按单词换行，超长单词再按字符拆分，否则按字符换行"""
+        metrics = self.metrics(font)
+        lines = []
+        for para in txt.splitlines() or [""]:
+            has_space = (" " in para)
+            sep = " " if has_space else ""
+            sep_w = metrics.width(sep)
+            units = para.split(" ") if has_space else list(para)
+            buf = ""
+            buf_w = 0.0
+
+            for u in units:
+                u_w = metrics.width(u)
+                # 计算 buf + 分隔符 + u 的宽度
+                if not buf:
+                    trial, w = u, u_w
+                else:
+                    joined = buf + sep
+                    joined_w = metrics.join_width(buf, buf_w, sep, sep_w)
+                    trial, w = joined + u, metrics.join_width(joined, joined_w, u, u_w)
+
+                if w <= max_w:
+                    buf, buf_w = trial, w
+                else:
+                    if buf:
+                        lines.append(buf)
+                    if has_space and len(u) > 1:
+                        tmp = ""
+                        tmp_w = 0.0
+                        for ch in u:
+                            ch_w = metrics.width(ch)
+                            trial_w = metrics.join_width(tmp, tmp_w, ch, ch_w)
+                            if trial_w <= max_w:
+                                tmp, tmp_w = tmp + ch, trial_w
+                            else:
+                                if tmp:
+                                    lines.append(tmp)
+                                tmp, tmp_w = ch, ch_w
+                        buf, buf_w = tmp, tmp_w
+                    else:
+                        if u_w <= max_w:
+                            buf, buf_w = u, u_w
+                        else:
+                            lines.append(u)
+                            buf, buf_w = "", 0.0
+            if buf != "":
+                lines.append(buf)
+            if para == "" and (not lines or lines[-1] != ""):
+                lines.append("")
+        return lines
+
+
+class FontSizeSolver:
+    """预测式字号求解器
+
+    先用参考字号下的文本宽度按比例缩放，估算出能放进区域的最大字号，
+    再只对估算值附近的一两个字号做精确换行验证；结果按文本和区域缓存，
+    重复的短语不再排版。在可容纳性随字号单调变化时，结果与二分查找一致。
+    """
+
+    # 估算时假设每行平均只能填满的宽度比例，用于抵消按词换行留下的空白
+    FILL_RATIO = 0.9
+
+    def __init__(self, layout: TextLayoutEngine, load_font: Callable[[int], FontType], cache_size: int = 4096):
+        self.layout = layout
+        self.load_font = load_font
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, Tuple[int, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # 精确换行的次数，用于观察每次求解验证了多少个字号
+        self.wraps = 0
+
+    def _fits(self, text: str, size: int, region_w: int, region_h: int, line_spacing: float) -> Optional[List[str]]:
+        """精确换行并判断是否放得下，放得下时返回各行文本"""
+        font = self.load_font(size)
+        lines = self.layout.wrap_lines(text, font, region_w)
+        self.wraps += 1
+        if len(lines) * font.size * (1 + line_spacing) <= region_h:
+            return lines
+        return None
+
+    def estimate(self, text: str, region_w: int, region_h: int,
+                 min_size: int, max_size: int, line_spacing: float) -> int:
+        """按参考字号下的段落宽度线性缩放，估算能放下的最大字号"""
+        ref_size = max_size
+        metrics = self.layout.metrics(self.load_font(ref_size))
+        para_widths = [metrics.width(para) / ref_size for para in (text.splitlines() or [""])]
+        usable_w = region_w * self.FILL_RATIO
+        # 连续近似：总宽度 × 行高 ≈ 区域面积，作为逐级估算的起点
+        total = sum(para_widths)
+        if total > 0:
+            start = int(math.sqrt(region_w * region_h * self.FILL_RATIO / (total * (1 + line_spacing))))
+        else:
+            start = max_size
+        size = max(min(start, max_size), min_size)
+        # 每个段落至少占一行，从起点向下找到估算行数放得下的字号
+        while size > min_size:
+            lines = sum(max(1, math.ceil(w * size / usable_w)) for w in para_widths)
+            if lines * size * (1 + line_spacing) <= region_h:
+                break
+            size -= 1
+        return size
+
+    def solve(self, text: str, region_w: int, region_h: int, min_size: int, max_size: int,
+              line_spacing: float, cache_tag: object = None) -> Tuple[int, List[str]]:
+        """返回（字号，各行文本），没有字号放得下时返回(1, [])"""
+        key = (text, region_w, region_h, min_size, max_size, line_spacing, cache_tag)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        result = self._solve(text, region_w, region_h, min_size, max_size, line_spacing)
+
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _solve(self, text: str, region_w: int, region_h: int, min_size: int, max_size: int,
+               line_spacing: float) -> Tuple[int, List[str]]:
+        if min_size > max_size:
+            return 1, []
+        size = self.estimate(text, region_w, region_h, min_size, max_size, line_spacing)
+        lines = self._fits(text, size, region_w, region_h, line_spacing)
+
+        if lines is not None:
+            # 估算值放得下，向上逐个尝试直到放不下
+            best = (size, lines)
+            step = 1
+            while best[0] < max_size:
+                probe = min(best[0] + step, max_size)
+                probe_lines = self._fits(text, probe, region_w, region_h, line_spacing)
+                if probe_lines is None:
+                    # 步长大于1时在(best, probe)之间二分
+                    return self._bisect(text, best, probe - 1, region_w, region_h, line_spacing)
+                best = (probe, probe_lines)
+                step *= 2
+            return best
+
+        # 估算值放不下，向下逐个尝试直到放得下
+        high = size - 1
+        step = 1
+        while high >= min_size:
+            probe = max(high - step + 1, min_size)
+            probe_lines = self._fits(text, probe, region_w, region_h, line_spacing)
+            if probe_lines is not None:
+                return self._bisect(text, (probe, probe_lines), high, region_w, region_h, line_spacing)
+            high = probe - 1
+            step *= 2
+        return 1, []
+
+    def _bisect(self, text: str, best: Tuple[int, List[str]], high: int,
+                region_w: int, region_h: int, line_spacing: float) -> Tuple[int, List[str]]:
+        """已知best放得下，在(best, high]之间二分查找最大可容纳字号"""
+        low = best[0] + 1
+        while low <= high:
+            mid = (low + high) // 2
+            lines = self._fits(text, mid, region_w, region_h, line_spacing)
+            if lines is not None:
+                best = (mid, lines)
+                low = mid + 1
+            else:
+                high = mid - 1
+        return best
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
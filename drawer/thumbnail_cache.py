@@ -0,0 +1,157 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+from PIL import Image
+
+# dHash按16位分成4段，汉明距离不超过3的两个哈希至少有一段完全相同
+_HASH_BANDS = 4
+_BAND_BITS = 16
+
+
+@dataclass(frozen=True)
+class ImageSignature:
+    """用于判断两张图片是否为同一张图重新编码的特征"""
+    dhash: int  # 64位差值哈希
+    aspect: float  # 宽高比
+    mean_color: Tuple[int, int, int]  # 平均颜色，区分dHash相同的纯色图
+    has_alpha: bool
+
+    def matches(self, other: "ImageSignature", max_distance: int) -> bool:
+        return (
+            bin(self.dhash ^ other.dhash).count("1") <= max_distance
+            and abs(self.aspect - other.aspect) <= 0.02 * max(self.aspect, other.aspect)
+            and max(abs(a - b) for a, b in zip(self.mean_color, other.mean_color)) <= 12
+            and self.has_alpha == other.has_alpha
+        )
+
+
+def image_signature(image: Image.Image) -> ImageSignature:
+    """计算图片的dHash、宽高比和平均颜色"""
+    src = image if image.mode in ("RGB", "RGBA", "L") else image.convert("RGBA")
+    small = src.resize((18, 16), Image.BOX, reducing_gap=2.0).convert("RGB")
+    gray = small.convert("L").resize((9, 8), Image.BOX).tobytes()
+    dhash = 0
+    for row in range(8):
+        for col in range(8):
+            dhash = (dhash << 1) | (gray[row * 9 + col] > gray[row * 9 + col + 1])
+    width, height = image.size
+    return ImageSignature(
+        dhash=dhash,
+        aspect=width / height,
+        mean_color=small.resize((1, 1), Image.BOX).getpixel((0, 0)),
+        has_alpha="A" in image.getbands() or "transparency" in image.info
+    )
+
+
+class ThumbnailCache:
+    """已缩放内容图片的缓存
+
+    按上传图片原始字节的sha256和缩放参数精确命中，跳过解码和LANCZOS缩放。
+    启用感知哈希时，字节不同但dHash相近、宽高比和平均颜色接近的图片视为同一张，
+    沿用第一次出现时的摘要，从而同时命中缩略图缓存和渲染结果缓存。
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, perceptual: bool = False,
+                 max_distance: int = 2, max_signatures: int = 4096):
+        self.max_bytes = max_bytes
+        self.perceptual = perceptual
+        self.max_distance = min(max(max_distance, 0), _HASH_BANDS - 1)
+        self.max_signatures = max_signatures
+        self._entries: "OrderedDict[Hashable, Image.Image]" = OrderedDict()
+        self._bytes = 0
+        # 摘要 -> 特征，以及按dHash分段建立的索引
+        self._signatures: "OrderedDict[str, ImageSignature]" = OrderedDict()
+        self._bands: Dict[Tuple[int, int], Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.perceptual_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _band_keys(dhash: int):
+        mask = (1 << _BAND_BITS) - 1
+        return [(i, (dhash >> (i * _BAND_BITS)) & mask) for i in range(_HASH_BANDS)]
+
+    def _register(self, digest: str, signature: ImageSignature) -> None:
+        self._signatures[digest] = signature
+        for band in self._band_keys(signature.dhash):
+            self._bands.setdefault(band, set()).add(digest)
+        while len(self._signatures) > self.max_signatures:
+            old_digest, old = self._signatures.popitem(last=False)
+            for band in self._band_keys(old.dhash):
+                digests = self._bands.get(band)
+                if digests is not None:
+                    digests.discard(old_digest)
+                    if not digests:
+                        del self._bands[band]
+
+    def _find(self, signature: ImageSignature) -> Optional[str]:
+        candidates = set()
+        for band in self._band_keys(signature.dhash):
+            candidates |= self._bands.get(band, set())
+        for digest in candidates:
+            if self._signatures[digest].matches(signature, self.max_distance):
+                return digest
+        return None
+
+    def resolve(self, digest: str, image: Image.Image) -> str:
+        """返回图片的规范摘要：感知哈希匹配到先前的图片时返回其摘要，否则登记并返回自身"""
+        if not self.perceptual:
+            return digest
+        with self._lock:
+            if digest in self._signatures:
+                self._signatures.move_to_end(digest)
+                return digest
+        # 计算特征需要解码图片，不持有锁
+        signature = image_signature(image)
+        with self._lock:
+            match = self._find(signature)
+            if match is not None:
+                self._signatures.move_to_end(match)
+                self.perceptual_hits += 1
+                return match
+            self._register(digest, signature)
+            return digest
+
+    def get(self, key: Hashable) -> Optional[Image.Image]:
+        """获取缓存的缩略图，调用方不得修改"""
+        with self._lock:
+            thumbnail = self._entries.get(key)
+            if thumbnail is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return thumbnail
+
+    def put(self, key: Hashable, thumbnail: Image.Image) -> None:
+        size = thumbnail.width * thumbnail.height * len(thumbnail.getbands())
+        if size > self.max_bytes:
+            return
+        thumbnail.readonly = 1
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.width * old.height * len(old.getbands())
+            self._entries[key] = thumbnail
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * len(evicted.getbands())
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "perceptual_hits": self.perceptual_hits,
+                "signatures": len(self._signatures),
+                "evictions": self.evictions
+            }
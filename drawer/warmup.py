@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import toml
+from core.core import log
+
+
+@dataclass(frozen=True)
+class WarmupItem:
+    """预渲染清单中的一条常用语"""
+    text: str
+    emotion: str = ""
+    output_format: Optional[str] = None
+
+
+def load_manifest(path: str) -> List[WarmupItem]:
+    """读取预渲染清单，文件不存在时返回空列表
+
+    清单为TOML格式，每条常用语是一个[[phrase]]表，包含text和可选的emotion、output_format。
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        data = toml.load(f)
+    items = []
+    for entry in data.get("phrase", []):
+        text = str(entry.get("text", ""))
+        if not text.strip():
+            continue
+        items.append(WarmupItem(text=text, emotion=entry.get("emotion", ""), output_format=entry.get("output_format")))
+    return items
+
+
+class WarmupRunner:
+    """按清单在后台线程中逐条预渲染，填充内存和磁盘中的渲染结果缓存
+
+    已在磁盘缓存中的常用语只读取一次放入内存，重启后无需重新渲染。
+    """
+
+    def __init__(self, generator, manifest_file: str):
+        self.generator = generator
+        self.manifest_file = manifest_file
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._status: Dict[str, Any] = {"running": False}
+
+    def start(self, background: bool = True) -> bool:
+        """启动一次预渲染，已有预渲染在进行时返回False；background为False时在当前线程中执行完毕再返回"""
+        with self._lock:
+            if self._status["running"]:
+                return False
+            self._status = {"running": True, "total": 0, "done": 0, "rendered": 0, "loaded": 0, "failed": 0,
+                            "started_at": time.time(), "finished_at": None}
+            if background:
+                self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+                self._thread.start()
+                return True
+        self._run()
+        return True
+
+    @property
+    def started(self) -> bool:
+        """是否已经执行过预渲染"""
+        with self._lock:
+            return "started_at" in self._status
+
+    def _update(self, **counters: int) -> None:
+        with self._lock:
+            for name, value in counters.items():
+                self._status[name] += value
+
+    def _run(self) -> None:
+        generator = self.generator
+        try:
+            items = load_manifest(self.manifest_file)
+        except Exception as e:
+            log.error(f"读取预渲染清单失败: {e}")
+            items = []
+        with self._lock:
+            self._status["total"] = len(items)
+        log.info(f"开始预渲染常用语: {len(items)}条")
+
+        for item in items:
+            try:
+                spec = generator.build_spec(text=item.text, emotion=item.emotion, output_format=item.output_format)
+                key = generator.render_cache_key(spec)
+                stored = generator.disk_cache is not None and key is not None and key in generator.disk_cache
+                # 已在磁盘缓存中时直接读取并填充内存缓存，否则渲染并写入两级缓存
+                generator.render(spec)
+                self._update(done=1, loaded=int(stored), rendered=int(not stored))
+            except Exception as e:
+                log.error(f"预渲染失败: {item.text[:50]}, {e}")
+                self._update(done=1, failed=1)
+
+        with self._lock:
+            self._status["running"] = False
+            self._status["finished_at"] = time.time()
+            status = dict(self._status)
+        log.info(f"预渲染完成: 渲染{status['rendered']}条，从磁盘加载{status['loaded']}条，失败{status['failed']}条")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._status)
@@ -1,23 +1,58 @@
+import os
+import time
 import uvicorn
-from api.api import anan_sketchbook_app as app
+
+# 记录导入应用前的时间，用于统计预加载耗时
+startup_started = time.perf_counter()
+
+import core.prefork as prefork
 from core.core import config, internal_config, log  # 导入internal_config
 
+
+def __getattr__(name: str):
+    """首次访问main.app时才导入应用，供`uvicorn main:app`使用
+
+    spawn方式启动的渲染工作进程会以__mp_main__的名字重新导入本模块，
+    不在模块顶层导入api.api，工作进程只由初始化函数创建素描本生成器。
+    """
+    if name == "app":
+        from api.api import anan_sketchbook_app
+        return anan_sketchbook_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     # 获取配置信息
     host = config.get("api_host", "0.0.0.0")
     port = config.get("api_port", 8000)
     reload = config.get("api.reload", False)
-    
+    workers = config.get("api_workers", 1) or (os.cpu_count() or 1)
+    if workers > 1 and (reload or not hasattr(os, "fork")):
+        log.warning("热重载模式或当前平台不支持多进程，使用单进程启动")
+        workers = 1
+
     # 记录启动日志
     log.info(f"Anan's Sketchbook API 启动中...")
     log.info(f"访问地址: http://{host}:{port}")
     log.info(f"API文档: http://{host}:{port}/docs")
-    
-    # 启动FastAPI服务器
-    uvicorn.run(
-        "main:app",
-        host=host,
-        port=port,
-        reload=reload,
-        log_level="info"
-    )
\ No newline at end of file
+
+    if reload:
+        # 热重载模式由uvicorn的子进程导入应用
+        uvicorn.run("main:app", host=host, port=port, reload=True, log_level="info")
+    else:
+        # 导入应用时加载字体、默认表情包的底图和静态画面
+        from api.api import anan_sketchbook_app as app, image_store, sketchbook_gen, warmup_runner
+        prefork.preload_seconds = round(time.perf_counter() - startup_started, 3)
+        log.info(f"预加载完成，用时{prefork.preload_seconds}秒，{prefork.format_memory(prefork.process_memory())}")
+
+        if workers == 1:
+            # 启动FastAPI服务器
+            uvicorn.run(app, host=host, port=port, log_level="info")
+        else:
+            # 内存和映射文件存储只在各自进程中可见，图片需要经由磁盘渲染缓存在进程间共享
+            if image_store.backend != "disk" and sketchbook_gen.disk_cache is None:
+                log.warning(f"{image_store.backend}存储后端的图片只能由生成它的工作进程返回，多进程模式建议启用磁盘渲染缓存或使用disk后端")
+            # 在fork前完成常用语预渲染，渲染结果缓存由所有工作进程共享
+            if warmup_runner is not None and config.get("warmup_config.on_startup", True):
+                warmup_runner.start(background=False)
+            prefork.PreforkServer(app, host, port, workers).run()
@@ -51,8 +51,8 @@ class Config:
             return value
         return self.config_data.get(key, default)
     
-    def set(self, key: str, value: Any) -> None:
-        """设置配置项"""
+    def set(self, key: str, value: Any, save: bool = True) -> None:
+        """设置配置项，save为False时只修改内存中的配置"""
         # 支持嵌套键设置
         if '.' in key:
             keys = key.split('.')
@@ -64,7 +64,8 @@ class Config:
             data[keys[-1]] = value
         else:
             self.config_data[key] = value
-        self.save()
+        if save:
+            self.save()
     
     def get_path(self, key: str, default: str = "") -> str:
         """获取路径配置，确保路径存在"""
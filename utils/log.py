@@ -1,52 +1,226 @@
 import os
+import json
+import queue
+import atexit
+import random
 import logging
-from typing import Optional
+import logging.handlers
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """按比例采样INFO及以下级别的日志，警告和错误始终保留"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or random.random() < self.rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class _ReopenMixin:
+    """多个进程写同一个日志文件时，其他进程已经轮转过文件则重新打开，不再重复轮转"""
+
+    def _reopen_if_rotated(self) -> bool:
+        if self.stream is None:
+            return False
+        try:
+            current = os.stat(self.baseFilename)
+            opened = os.fstat(self.stream.fileno())
+        except OSError:
+            current = opened = None
+        if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+            return False
+        self.stream.close()
+        self.stream = self._open()
+        return True
+
+
+class SizeRotatingFileHandler(_ReopenMixin, logging.handlers.RotatingFileHandler):
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self._reopen_if_rotated():
+            return False
+        return super().shouldRollover(record)
+
+
+class TimeRotatingFileHandler(_ReopenMixin, logging.handlers.TimedRotatingFileHandler):
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self._reopen_if_rotated():
+            self.rolloverAt = self.computeRollover(int(record.created))
+            return False
+        return super().shouldRollover(record)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列已满时丢弃日志而不是阻塞调用方
+
+    使用C实现的SimpleQueue，入队不需要获取Python层面的锁，按队列长度限制积压的日志数。
+    """
+
+    def __init__(self, log_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只在同一进程的线程间传递，格式化留给写入线程
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.max_size > 0 and self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
 
 class Logos:
-    def __init__(self, name: str = "AnanSketchbook", log_file: Optional[str] = None):
+    """日志记录器
+
+    调用方只把日志放入内存队列，由后台线程写入控制台和日志文件，记录日志不会等待磁盘。
+    日志文件可按大小或时间轮转，可选输出JSON格式并按比例采样INFO及以下级别的日志。
+    fork出的子进程会重新创建队列和写入线程。
+    """
+
+    def __init__(self,
+                 name: str = "AnanSketchbook",
+                 log_file: Optional[str] = None,
+                 level: str = "INFO",
+                 rotation: str = "size",
+                 max_bytes: int = 10 * 1024 * 1024,
+                 rotate_when: str = "midnight",
+                 backup_count: int = 7,
+                 json_format: bool = False,
+                 sample_rate: float = 1.0,
+                 queue_size: int = 10000):
         # 创建logger对象
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(logging.DEBUG)  # 设置最低日志级别
-        
+        levels = logging.getLevelNamesMapping()
+        invalid_level = str(level).upper() not in levels
+        self.logger.setLevel(logging.INFO if invalid_level else levels[str(level).upper()])
+        self.logger.propagate = False
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+        # 定义日志格式
+        if json_format:
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+        # 控制台和文件处理器只在写入线程中使用
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        self.handlers = [console_handler]
+        if log_file:
+            # 确保日志目录存在
+            log_dir = os.path.dirname(log_file)
+            if log_dir and not os.path.exists(log_dir):
+                os.makedirs(log_dir, exist_ok=True)
+            file_handler = self._create_file_handler(log_file, rotation, max_bytes, rotate_when, backup_count)
+            file_handler.setFormatter(formatter)
+            self.handlers.append(file_handler)
+
         # 检查是否已经添加过处理器，避免重复添加
+        self.queue_handler: Optional[_DroppingQueueHandler] = None
+        self.sampler = SampleFilter(sample_rate) if sample_rate < 1 else None
         if not self.logger.handlers:
-            # 定义日志格式
-            formatter = logging.Formatter(
-                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-            )
-            
-            # 添加控制台处理器
-            console_handler = logging.StreamHandler()
-            console_handler.setFormatter(formatter)
-            self.logger.addHandler(console_handler)
-            
-            # 添加文件处理器（如果指定了日志文件）
-            if log_file:
-                # 确保日志目录存在
-                log_dir = os.path.dirname(log_file)
-                if log_dir and not os.path.exists(log_dir):
-                    os.makedirs(log_dir)
-                
-                file_handler = logging.FileHandler(log_file, encoding='utf-8')
-                file_handler.setFormatter(formatter)
-                self.logger.addHandler(file_handler)
-    
+            self.queue_handler = _DroppingQueueHandler(queue.SimpleQueue(), queue_size)
+            if self.sampler is not None:
+                self.queue_handler.addFilter(self.sampler)
+            self.logger.addHandler(self.queue_handler)
+            self._start_listener()
+            atexit.register(self.stop)
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=self._after_fork)
+        if invalid_level:
+            self.warning(f"无效的日志级别{level!r}，使用INFO")
+
+    @staticmethod
+    def _create_file_handler(log_file: str, rotation: str, max_bytes: int, rotate_when: str,
+                             backup_count: int) -> logging.Handler:
+        if rotation == "size" and max_bytes > 0:
+            return SizeRotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                           encoding='utf-8', delay=True)
+        if rotation == "time" and rotate_when:
+            return TimeRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count,
+                                           encoding='utf-8', delay=True)
+        return logging.FileHandler(log_file, encoding='utf-8', delay=True)
+
+    def _start_listener(self) -> None:
+        self._listener = logging.handlers.QueueListener(
+            self.queue_handler.queue, *self.handlers, respect_handler_level=True
+        )
+        self._listener.start()
+
+    def _after_fork(self) -> None:
+        # 父进程的写入线程不会被继承，队列也可能正被写入线程读取，
+        # 父进程尚未写出的日志由父进程负责，子进程使用新的队列
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.queue_handler.dropped = 0
+        self._start_listener()
+
+    def stop(self) -> None:
+        """写出队列中剩余的日志并停止写入线程"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+        for handler in self.handlers:
+            handler.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """队列中的日志数和丢弃数"""
+        if self.queue_handler is None:
+            return {}
+        return {
+            "level": logging.getLevelName(self.logger.level),
+            "queued": self.queue_handler.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+            "sampled_out": self.sampler.dropped if self.sampler is not None else 0
+        }
+
+    def _log(self, level: int, message: str) -> None:
+        logger = self.logger
+        if logger.isEnabledFor(level):
+            # 日志格式中没有用到文件名和行号，跳过查找调用位置
+            logger.handle(logger.makeRecord(logger.name, level, "", 0, message, None, None))
+
     def info(self, message: str) -> None:
         """记录信息日志"""
-        self.logger.info(message)
-    
+        self._log(logging.INFO, message)
+
     def error(self, message: str) -> None:
         """记录错误日志"""
-        self.logger.error(message)
-    
+        self._log(logging.ERROR, message)
+
     def warning(self, message: str) -> None:
         """记录警告日志"""
-        self.logger.warning(message)
-    
+        self._log(logging.WARNING, message)
+
     def debug(self, message: str) -> None:
         """记录调试日志"""
-        self.logger.debug(message)
-    
+        self._log(logging.DEBUG, message)
+
     def critical(self, message: str) -> None:
         """记录严重错误日志"""
-        self.logger.critical(message)
\ No newline at end of file
+        self._log(logging.CRITICAL, message)